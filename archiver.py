@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Archivador de sesiones del fotomatón
+- Recomprime fotos originales y tiras (JPEG progresivo o WebP)
+- Genera una hoja de contactos por sesión
+- Escribe un manifiesto (manifest.json) para poder reanudar el trabajo
+- Reparte el trabajo entre todos los núcleos con un pool de procesos
+- Se pausa mientras haya una sesión en curso en el fotomatón
+
+Uso: python3 archiver.py [directorio]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+from collections import deque
+from multiprocessing import Pool
+from PIL import Image
+
+from booth_settings import (
+    get_save_directory, session_active, TOTAL_PHOTOS,
+    ARCHIVE_FORMAT, ARCHIVE_QUALITY, ARCHIVE_PROGRESSIVE, ARCHIVE_WORKERS,
+    ARCHIVE_MIN_AGE, ARCHIVE_CONTACT_SHEETS,
+)
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# Ficheros generados por PhotoboothGUI: fotos individuales y tira DNP
+SESSION_FILE_RE = re.compile(r'^photobooth_(\d{8}_\d{6}(?:_\d+)?)_(foto\d+|tira_dnp)\.(jpg|webp)$')
+
+CONTACT_THUMB_WIDTH = 400   # Ancho de cada miniatura en la hoja de contactos
+CONTACT_SPACING = 10        # Espacio entre miniaturas
+IDLE_POLL_INTERVAL = 2      # Segundos entre comprobaciones de sesión activa
+
+
+def wait_for_idle():
+    """Bloquea mientras el fotomatón tenga una sesión en curso."""
+    announced = False
+    while session_active():
+        if not announced:
+            print("Sesión en curso en el fotomatón. Archivador en pausa...")
+            announced = True
+        time.sleep(IDLE_POLL_INTERVAL)
+    if announced:
+        print("Fotomatón libre. Reanudando archivado.")
+
+
+def run_throttled(pool, func, tasks, workers):
+    """Ejecuta las tareas en el pool con como mucho `workers` a la vez.
+
+    Cada tarea se envía desde este proceso después de comprobar que no hay
+    una sesión en curso, así que una sesión que empieza a mitad de lote
+    pausa el archivado tras los ficheros que ya se estaban procesando.
+    (imap_unordered consume el generador de tareas de golpe en otro hilo.)
+    """
+    in_flight = deque()
+    for task in tasks:
+        while len(in_flight) >= workers:
+            yield in_flight.popleft().get()
+        wait_for_idle()
+        in_flight.append(pool.apply_async(func, (task,)))
+    while in_flight:
+        yield in_flight.popleft().get()
+
+
+def init_worker():
+    """Baja la prioridad de los procesos del pool para no competir con la GUI."""
+    try:
+        os.nice(19)
+    except OSError:
+        pass
+
+
+def load_manifest(directory):
+    """Carga el manifiesto del directorio o devuelve uno vacío."""
+    path = os.path.join(directory, MANIFEST_NAME)
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+        print(f"Versión de manifiesto desconocida en {path}, se empieza de cero")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"Error al leer el manifiesto {path}: {e}")
+    return {'version': MANIFEST_VERSION, 'files': {}, 'contact_sheets': {}}
+
+
+def save_manifest(directory, manifest):
+    """Guarda el manifiesto de forma atómica (fichero temporal + rename)."""
+    path = os.path.join(directory, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def recompress_file(task):
+    """Recomprime un fichero del archivo. Se ejecuta en un proceso del pool."""
+    directory, name, fmt, quality, progressive = task
+    src = os.path.join(directory, name)
+    base, _ = os.path.splitext(name)
+    out_name = base + ('.webp' if fmt == 'webp' else '.jpg')
+    out_path = os.path.join(directory, out_name)
+    tmp_path = out_path + '.tmp'
+    started = time.time()
+
+    try:
+        source_bytes = os.path.getsize(src)
+        with Image.open(src) as image:
+            image = image.convert('RGB')
+            dpi = image.info.get('dpi')
+            save_args = {'quality': quality}
+            if dpi:
+                save_args['dpi'] = dpi
+            if fmt == 'webp':
+                image.save(tmp_path, 'WEBP', method=4, **save_args)
+            else:
+                image.save(tmp_path, 'JPEG', optimize=True, progressive=progressive, **save_args)
+
+        # Verificar que el resultado se puede leer antes de sustituir el original
+        with Image.open(tmp_path) as check:
+            check.load()
+
+        new_bytes = os.path.getsize(tmp_path)
+        if new_bytes >= source_bytes and out_name == name:
+            # No compensa: conservar el original
+            os.remove(tmp_path)
+            out_name, new_bytes = name, source_bytes
+        else:
+            os.replace(tmp_path, out_path)
+            if out_name != name:
+                os.remove(src)
+
+        return name, {
+            'file': out_name,
+            'source_bytes': source_bytes,
+            'bytes': new_bytes,
+            'format': fmt,
+            'quality': quality,
+            'progressive': bool(progressive and fmt != 'webp'),
+            'seconds': round(time.time() - started, 3),
+        }, None
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return name, None, str(e)
+
+
+def build_contact_sheet(task):
+    """Genera la hoja de contactos de una sesión. Se ejecuta en un proceso del pool."""
+    directory, session, photo_names, fmt, quality = task
+    ext = '.webp' if fmt == 'webp' else '.jpg'
+    out_name = f"photobooth_{session}_contactos{ext}"
+    out_path = os.path.join(directory, out_name)
+    tmp_path = out_path + '.tmp'
+
+    try:
+        thumbs = []
+        for name in photo_names:
+            with Image.open(os.path.join(directory, name)) as image:
+                image = image.convert('RGB')
+                ratio = CONTACT_THUMB_WIDTH / image.width
+                thumbs.append(image.resize((CONTACT_THUMB_WIDTH, int(image.height * ratio)),
+                                           Image.Resampling.LANCZOS))
+
+        thumb_height = max(t.height for t in thumbs)
+        width = len(thumbs) * CONTACT_THUMB_WIDTH + (len(thumbs) + 1) * CONTACT_SPACING
+        height = thumb_height + 2 * CONTACT_SPACING
+        sheet = Image.new('RGB', (width, height), 'white')
+        for i, thumb in enumerate(thumbs):
+            sheet.paste(thumb, (CONTACT_SPACING + i * (CONTACT_THUMB_WIDTH + CONTACT_SPACING), CONTACT_SPACING))
+
+        if fmt == 'webp':
+            sheet.save(tmp_path, 'WEBP', quality=quality)
+        else:
+            sheet.save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+        os.replace(tmp_path, out_path)
+        return session, out_name, None
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return session, None, str(e)
+
+
+def is_done(entry, fmt, quality):
+    """Indica si una entrada del manifiesto ya cumple la configuración actual."""
+    return entry is not None and entry.get('format') == fmt and entry.get('quality') <= quality
+
+
+def find_pending(directory, manifest, fmt, quality):
+    """Devuelve los ficheros que todavía no se han recomprimido."""
+    now = time.time()
+    processed = {entry['file'] for entry in manifest['files'].values()
+                 if is_done(entry, fmt, quality)}
+    pending = []
+    for name in sorted(os.listdir(directory)):
+        if not SESSION_FILE_RE.match(name) or name in processed:
+            continue
+        if is_done(manifest['files'].get(name), fmt, quality):
+            continue
+        # No tocar ficheros de una sesión que todavía se está escribiendo
+        if now - os.path.getmtime(os.path.join(directory, name)) < ARCHIVE_MIN_AGE:
+            continue
+        pending.append(name)
+    return pending
+
+
+def find_sessions_without_sheet(directory, manifest):
+    """Agrupa las fotos por sesión y devuelve las sesiones sin hoja de contactos."""
+    sessions = {}
+    for entry in manifest['files'].values():
+        match = SESSION_FILE_RE.match(entry['file'])
+        if match and match.group(2).startswith('foto'):
+            sessions.setdefault(match.group(1), []).append(entry['file'])
+
+    result = []
+    for session, names in sorted(sessions.items()):
+        if session in manifest['contact_sheets'] or len(names) < TOTAL_PHOTOS:
+            continue
+        result.append((session, sorted(names)))
+    return result
+
+
+def run_archive(directory, fmt=ARCHIVE_FORMAT, quality=ARCHIVE_QUALITY,
+                progressive=ARCHIVE_PROGRESSIVE, workers=ARCHIVE_WORKERS):
+    """Recomprime el archivo y genera hojas de contactos. Devuelve un resumen."""
+    manifest = load_manifest(directory)
+    pending = find_pending(directory, manifest, fmt, quality)
+    print(f"Archivando {directory}: {len(pending)} ficheros pendientes, {workers} procesos")
+
+    summary = {'files': 0, 'errors': 0, 'source_bytes': 0, 'bytes': 0, 'contact_sheets': 0}
+    started = time.time()
+
+    with Pool(processes=workers, initializer=init_worker) as pool:
+        tasks = ((directory, name, fmt, quality, progressive) for name in pending)
+        for name, entry, error in run_throttled(pool, recompress_file, tasks, workers):
+            if error:
+                print(f"Error al recomprimir {name}: {error}")
+                summary['errors'] += 1
+                continue
+            manifest['files'].pop(name, None)
+            manifest['files'][entry['file']] = entry
+            save_manifest(directory, manifest)  # Guardar tras cada fichero para poder reanudar
+            summary['files'] += 1
+            summary['source_bytes'] += entry['source_bytes']
+            summary['bytes'] += entry['bytes']
+
+        if ARCHIVE_CONTACT_SHEETS:
+            sheets = ((directory, session, names, fmt, quality)
+                      for session, names in find_sessions_without_sheet(directory, manifest))
+            for session, out_name, error in run_throttled(pool, build_contact_sheet, sheets, workers):
+                if error:
+                    print(f"Error al crear hoja de contactos de {session}: {error}")
+                    summary['errors'] += 1
+                    continue
+                manifest['contact_sheets'][session] = out_name
+                save_manifest(directory, manifest)
+                summary['contact_sheets'] += 1
+
+    elapsed = time.time() - started
+    saved = summary['source_bytes'] - summary['bytes']
+    print(f"Archivado terminado en {elapsed:.1f}s: {summary['files']} ficheros, "
+          f"{summary['contact_sheets']} hojas de contactos, {summary['errors']} errores, "
+          f"{saved / (1024 * 1024):.1f} MB liberados")
+    return summary
+
+
+if __name__ == "__main__":
+    target_dir = sys.argv[1] if len(sys.argv) > 1 else get_save_directory()
+    if not target_dir or not os.path.isdir(target_dir):
+        print("No hay directorio de fotos que archivar")
+        sys.exit(1)
+    run_archive(target_dir)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Configuración del fotomatón (settings.yml) compartida por la GUI y las herramientas
+- Sin dependencias de hardware ni de pygame, para que archiver.py y otras
+  herramientas puedan leer la configuración sin arrancar la GUI
+"""
+
+import os
+import tempfile
+import yaml
+
+# Load the YAML settings file
+try:
+    with open('settings.yml', 'r') as file:
+        settings = yaml.safe_load(file)
+        print(f"Settings successfully loaded from {file.name}")
+        
+except Exception as e:
+    print(f"Error loading settings file from settings.yml: {e}")
+    print("Using default settings.")
+    settings = {}
+
+TOTAL_PHOTOS = 3  # Número total de fotos a tomar
+
+# Configuración del archivo de sesiones (archiver.py)
+ARCHIVE_FORMAT = settings.get('ARCHIVE_FORMAT', 'jpeg')         # 'jpeg' o 'webp'
+ARCHIVE_QUALITY = settings.get('ARCHIVE_QUALITY', 90)           # Calidad de recompresión (90 sigue siendo calidad de impresión)
+ARCHIVE_PROGRESSIVE = settings.get('ARCHIVE_PROGRESSIVE', True) # JPEG progresivo
+ARCHIVE_WORKERS = settings.get('ARCHIVE_WORKERS', os.cpu_count() or 1)  # Procesos en paralelo
+ARCHIVE_MIN_AGE = settings.get('ARCHIVE_MIN_AGE', 120)          # Segundos antes de tocar un fichero recién escrito
+ARCHIVE_CONTACT_SHEETS = settings.get('ARCHIVE_CONTACT_SHEETS', True)  # Generar hoja de contactos por sesión
+
+# Fichero que indica que hay una sesión en curso (el archivador se pausa mientras exista)
+SESSION_ACTIVE_FLAG = os.path.join(tempfile.gettempdir(), 'photobooth_sesion_activa')
+
+
+def session_active(flag=SESSION_ACTIVE_FLAG):
+    """Indica si hay una sesión en curso.
+
+    El fichero guarda el pid del fotomatón: si ese proceso ya no existe,
+    el indicador es de una ejecución que murió y no cuenta.
+    """
+    try:
+        with open(flag, 'r') as f:
+            pid = int(f.read().strip())
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError):
+        return False  # Indicador ilegible: no bloquear el archivado por él
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Existe, aunque sea de otro usuario
+    return True
+
+# Configuración de directorios - ahora se determina dinámicamente
+def get_save_directory():
+    """Detecta si hay un pendrive USB y devuelve la ruta de guardado."""
+    # Directorios comunes donde se montan dispositivos USB en Raspberry Pi/Linux
+    usb_mount_paths = [
+        '/media/pi',      # Raspberry Pi OS
+        '/media',         # Sistemas Linux generales
+        '/mnt',           # Montajes manuales
+        '/run/media'      # Algunas distribuciones
+    ]
+    
+    for base_path in usb_mount_paths:
+        if os.path.exists(base_path):
+            try:
+                # Buscar subdirectorios (dispositivos montados)
+                for item in os.listdir(base_path):
+                    usb_path = os.path.join(base_path, item)
+                    if os.path.isdir(usb_path):
+                        # Verificar si podemos escribir en el directorio
+                        test_file = os.path.join(usb_path, '.photobooth_test')
+                        try:
+                            with open(test_file, 'w') as f:
+                                f.write('test')
+                            os.remove(test_file)
+                            
+                            # Crear carpeta para fotos en el pendrive
+                            photobooth_dir = os.path.join(usb_path, 'photobooth_images')
+                            if not os.path.exists(photobooth_dir):
+                                os.makedirs(photobooth_dir)
+                            
+                            print(f"Pendrive USB detectado: {usb_path}")
+                            return photobooth_dir
+                        except (PermissionError, OSError):
+                            # No se puede escribir, continuar buscando
+                            continue
+            except (PermissionError, OSError):
+                # No se puede acceder al directorio, continuar
+                continue
+    
+    print("No se detectó ningún pendrive USB con permisos de escritura")
+    return None
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Etapa de codificación de imágenes del fotomatón
+- Codifica con cv2.imencode (libera el GIL: varios hilos usan varios núcleos)
+- Perfiles por tipo de salida: máster de archivo y tira de impresión
+- Calidad, submuestreo de croma y JPEG progresivo configurables por perfil
+- Informa del tiempo de codificación y de los bytes escritos por salida
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+DEFAULT_PROFILES = {
+    # Fotos individuales guardadas en el pendrive
+    'archive': {'format': 'jpeg', 'quality': 95, 'subsampling': '422', 'progressive': False, 'optimize': True},
+    # Tira que se envía a la impresora: sin submuestreo de color
+    'strip': {'format': 'jpeg', 'quality': 95, 'subsampling': '444', 'progressive': False, 'optimize': False},
+}
+
+# Perfiles que acaban en CUPS: la impresora DNP solo acepta JPEG
+PRINT_PROFILES = ('strip',)
+
+# Las constantes de submuestreo solo existen en OpenCV >= 4.7
+_SAMPLING_FACTORS = {
+    '444': getattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR_444', None),
+    '422': getattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR_422', None),
+    '420': getattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR_420', None),
+}
+
+
+def set_jfif_dpi(data, dpi):
+    """Escribe la resolución (DPI) en la cabecera JFIF de un JPEG codificado por OpenCV."""
+    if data[6:11] != b'JFIF\x00':
+        return data
+    data = bytearray(data)
+    data[13] = 1  # Unidades: puntos por pulgada
+    data[14:16] = dpi.to_bytes(2, 'big')
+    data[16:18] = dpi.to_bytes(2, 'big')
+    return bytes(data)
+
+
+class OutputEncoder:
+    def __init__(self, profiles=None, workers=None):
+        self.profiles = {name: dict(profile) for name, profile in DEFAULT_PROFILES.items()}
+        for name, overrides in (profiles or {}).items():
+            self.profiles.setdefault(name, {}).update(overrides)
+        for name in PRINT_PROFILES:
+            if self.profiles[name].get('format', 'jpeg') != 'jpeg':
+                print(f"El perfil '{name}' se imprime y tiene que ser JPEG: se ignora "
+                      f"el formato '{self.profiles[name]['format']}'")
+                self.profiles[name]['format'] = 'jpeg'
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                           thread_name_prefix='encoder')
+        self.lock = threading.Lock()
+        self.stats = {name: {'count': 0, 'bytes': 0, 'encode_ms': 0.0, 'write_ms': 0.0}
+                      for name in self.profiles}
+
+    def extension(self, profile):
+        """Extensión de fichero que corresponde al formato del perfil."""
+        return '.webp' if self.profiles[profile].get('format', 'jpeg') == 'webp' else '.jpg'
+
+    def params(self, profile):
+        """Parámetros de cv2.imencode para un perfil. Devuelve (extensión, parámetros)."""
+        settings = self.profiles[profile]
+        if self.extension(profile) == '.webp':
+            return '.webp', [cv2.IMWRITE_WEBP_QUALITY, int(settings.get('quality', 90))]
+
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(settings.get('quality', 95)),
+                  cv2.IMWRITE_JPEG_PROGRESSIVE, int(bool(settings.get('progressive', False))),
+                  cv2.IMWRITE_JPEG_OPTIMIZE, int(bool(settings.get('optimize', False)))]
+        sampling = _SAMPLING_FACTORS.get(str(settings.get('subsampling', '420')))
+        if sampling is not None:
+            params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, sampling]
+        return '.jpg', params
+
+    def encode(self, image, profile, dpi=None):
+        """Codifica una imagen BGR y devuelve los bytes."""
+        ext, params = self.params(profile)
+        ok, buffer = cv2.imencode(ext, image, params)
+        if not ok:
+            raise RuntimeError(f"No se pudo codificar la imagen con el perfil '{profile}'")
+        data = buffer.tobytes()
+        if dpi and ext == '.jpg':
+            data = set_jfif_dpi(data, dpi)
+        return data
+
+    def write(self, image, path, profile, dpi=None):
+        """Codifica y guarda una imagen BGR. Devuelve la ruta escrita."""
+        started = time.perf_counter()
+        data = self.encode(image, profile, dpi)
+        encoded = time.perf_counter()
+        with open(path, 'wb') as f:
+            f.write(data)
+        written = time.perf_counter()
+
+        encode_ms = (encoded - started) * 1000
+        write_ms = (written - encoded) * 1000
+        with self.lock:
+            stats = self.stats.setdefault(profile, {'count': 0, 'bytes': 0, 'encode_ms': 0.0, 'write_ms': 0.0})
+            stats['count'] += 1
+            stats['bytes'] += len(data)
+            stats['encode_ms'] += encode_ms
+            stats['write_ms'] += write_ms
+        print(f"[{profile}] {os.path.basename(path)}: {len(data) // 1024} KB, "
+              f"codificado en {encode_ms:.0f} ms, escrito en {write_ms:.0f} ms")
+        return path
+
+    def submit(self, image, path, profile, dpi=None):
+        """Codifica y guarda en segundo plano. Devuelve un Future con la ruta."""
+        return self.executor.submit(self.write, image, path, profile, dpi)
+
+    def wait(self, futures):
+        """Espera a que terminen las codificaciones. Devuelve las rutas (None si falló)."""
+        paths = []
+        for future in futures:
+            try:
+                paths.append(future.result())
+            except Exception as e:
+                print(f"Error al codificar imagen: {e}")
+                paths.append(None)
+        return paths
+
+    def summary(self):
+        """Resumen por perfil: número de salidas, bytes y tiempos medios."""
+        with self.lock:
+            return {profile: {
+                'count': s['count'],
+                'bytes': s['bytes'],
+                'avg_kb': round(s['bytes'] / s['count'] / 1024, 1) if s['count'] else 0,
+                'avg_encode_ms': round(s['encode_ms'] / s['count'], 1) if s['count'] else 0,
+                'avg_write_ms': round(s['write_ms'] / s['count'], 1) if s['count'] else 0,
+            } for profile, s in self.stats.items()}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+CUPS simulado para la prueba de resistencia y la simulación del grupo de impresoras
+- Varias colas que imprimen en orden con un tiempo fijo por trabajo
+- Estados IPP de impresora y de trabajo, getJobs, cancelJob y fallos provocados
+"""
+
+import time
+import threading
+from collections import Counter
+
+
+class FakeCupsConnection:
+    """Sustituye a cups.Connection.
+
+    Cada impresora simulada imprime sus trabajos en orden, tardando
+    print_time segundos reales por trabajo, y puede ponerse en error.
+    """
+    JOB_PENDING = 3
+    JOB_PROCESSING = 5
+    JOB_CANCELED = 7
+    JOB_COMPLETED = 9
+
+    def __init__(self, printers=('Simulada',), spool_delay=0.0, print_time=0.0):
+        self.printers = {name: {'printer-state': 3, 'printer-state-reasons': ['none'],
+                                'printer-is-accepting-jobs': True}
+                         for name in printers}
+        self.spool_delay = spool_delay
+        self.print_time = print_time
+        self.jobs = []          # (impresora, fichero) por orden de llegada; job_id = posición + 1
+        self.job_state = {}
+        self.queues = {name: [] for name in printers}
+        self.busy = {name: None for name in printers}  # (job_id, hora de fin)
+        self.lock = threading.Lock()
+
+    def _update(self):
+        """Avanza la simulación de impresión hasta ahora."""
+        now = time.monotonic()
+        for name, queue in self.queues.items():
+            ready = self.printers[name]['printer-state'] != 5
+            while True:
+                current = self.busy[name]
+                if current is not None:
+                    job_id, done_at = current
+                    if not ready or done_at > now:
+                        break
+                    self.job_state[job_id] = self.JOB_COMPLETED
+                    self.busy[name] = None
+                    start = done_at
+                else:
+                    start = now
+                if not queue or not ready:
+                    break
+                job_id = queue.pop(0)
+                self.job_state[job_id] = self.JOB_PROCESSING
+                self.busy[name] = (job_id, start + self.print_time)
+
+    def getPrinters(self):
+        with self.lock:
+            self._update()
+            return {name: dict(attrs) for name, attrs in self.printers.items()}
+
+    def getJobs(self, which_jobs='not-completed', requested_attributes=None, **kwargs):
+        with self.lock:
+            self._update()
+            return {job_id: {'job-id': job_id, 'job-state': state,
+                             'job-printer-uri': f"ipp://localhost/printers/{self.jobs[job_id - 1][0]}"}
+                    for job_id, state in self.job_state.items()
+                    if state in (self.JOB_PENDING, self.JOB_PROCESSING)}
+
+    def printFile(self, printer, filename, title, options):
+        if self.spool_delay:
+            time.sleep(self.spool_delay)
+        with self.lock:
+            self.jobs.append((printer, filename))
+            job_id = len(self.jobs)
+            self.job_state[job_id] = self.JOB_PENDING
+            self.queues[printer].append(job_id)
+            self._update()
+            return job_id
+
+    def cancelJob(self, job_id):
+        with self.lock:
+            printer = self.jobs[job_id - 1][0]
+            if job_id in self.queues[printer]:
+                self.queues[printer].remove(job_id)
+            if self.busy[printer] and self.busy[printer][0] == job_id:
+                self.busy[printer] = None
+            self.job_state[job_id] = self.JOB_CANCELED
+
+    def set_printer_error(self, printer, reason):
+        """Simula un fallo (p. ej. 'media-empty-error') o lo resuelve con reason=None."""
+        with self.lock:
+            self._update()
+            attrs = self.printers[printer]
+            attrs['printer-state'] = 5 if reason else 3
+            attrs['printer-state-reasons'] = [reason] if reason else ['none']
+
+    def pending_jobs(self):
+        return len(self.getJobs())
+
+    def completed_by_printer(self):
+        with self.lock:
+            self._update()
+            return Counter(self.jobs[job_id - 1][0] for job_id, state in self.job_state.items()
+                           if state == self.JOB_COMPLETED)
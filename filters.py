@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filtros de color para la vista previa y las fotos
+- Cada filtro es una matriz de color 3x3 y/o una tabla LUT precalculada
+- Se aplican sobre frames BGR de OpenCV (vista previa y captura a resolución completa)
+- Incluye una prueba de rendimiento por frame: python3 filters.py --benchmark
+"""
+
+import time
+import argparse
+import cv2
+import numpy as np
+
+
+def rgb_matrix_to_bgr(matrix):
+    """Convierte una matriz de color definida en RGB al orden BGR de OpenCV."""
+    m = np.asarray(matrix, dtype=np.float32)
+    return m[::-1, ::-1].copy()
+
+
+def curve_lut(r_curve, g_curve, b_curve):
+    """Crea una LUT (1, 256, 3) en orden BGR a partir de tres funciones 0..1 -> 0..1."""
+    x = np.linspace(0.0, 1.0, 256)
+    channels = [np.clip(curve(x), 0.0, 1.0) * 255 for curve in (b_curve, g_curve, r_curve)]
+    return np.round(np.dstack(channels)).astype(np.uint8).reshape(1, 256, 3)
+
+
+class ColorFilter:
+    """Filtro de color precalculado: matriz 3x3 (opcional) seguida de LUT (opcional)."""
+    def __init__(self, name, label, matrix=None, lut=None):
+        self.name = name
+        self.label = label  # Texto que se muestra en pantalla
+        self.matrix = rgb_matrix_to_bgr(matrix) if matrix is not None else None
+        self.lut = lut
+
+    def apply(self, frame):
+        """Aplica el filtro a un frame BGR uint8 y devuelve el resultado."""
+        if self.matrix is not None:
+            frame = cv2.transform(frame, self.matrix)
+        if self.lut is not None:
+            frame = cv2.LUT(frame, self.lut)
+        return frame
+
+
+class NoFilter(ColorFilter):
+    def __init__(self):
+        super().__init__('normal', 'NORMAL')
+
+    def apply(self, frame):
+        return frame
+
+
+# Luminancia Rec. 601, la misma que usa cv2.cvtColor para pasar a gris
+_GRAY = [0.299, 0.587, 0.114]
+
+FILTERS = {
+    'normal': NoFilter(),
+    'blanco_negro': ColorFilter(
+        'blanco_negro', 'BLANCO Y NEGRO',
+        matrix=[_GRAY, _GRAY, _GRAY],
+        # Un poco más de contraste para que el blanco y negro no quede plano
+        lut=curve_lut(*[lambda x: (x - 0.5) * 1.15 + 0.5] * 3),
+    ),
+    'sepia': ColorFilter(
+        'sepia', 'SEPIA',
+        matrix=[[0.393, 0.769, 0.189],
+                [0.349, 0.686, 0.168],
+                [0.272, 0.534, 0.131]],
+    ),
+    'vintage': ColorFilter(
+        'vintage', 'VINTAGE',
+        # Colores algo desaturados y cálidos
+        matrix=[[0.90, 0.10, 0.00],
+                [0.05, 0.85, 0.10],
+                [0.05, 0.10, 0.75]],
+        # Negros levantados y altas luces suaves, con dominante amarilla
+        lut=curve_lut(lambda x: 0.08 + 0.90 * x,
+                      lambda x: 0.06 + 0.86 * x,
+                      lambda x: 0.12 + 0.70 * x),
+    ),
+}
+
+
+def get_filter(name):
+    """Devuelve el filtro con ese nombre o el filtro normal si no existe."""
+    if name not in FILTERS:
+        print(f"Filtro desconocido '{name}', se usa 'normal'")
+        return FILTERS['normal']
+    return FILTERS[name]
+
+
+def benchmark(sizes, iterations=100):
+    """Mide el coste por frame de cada filtro en cada resolución. Devuelve {(filtro, tamaño): ms}."""
+    results = {}
+    rng = np.random.default_rng(0)
+    for width, height in sizes:
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        for name, color_filter in FILTERS.items():
+            color_filter.apply(frame)  # Calentamiento
+            started = time.perf_counter()
+            for _ in range(iterations):
+                color_filter.apply(frame)
+            ms = (time.perf_counter() - started) * 1000 / iterations
+            results[(name, (width, height))] = ms
+            fps = 1000 / ms if ms else float('inf')
+            status = 'OK' if ms < 1000 / 30 else 'LENTO'
+            print(f"{name:14s} {width:5d}x{height:<5d} {ms:8.2f} ms/frame  {fps:8.1f} FPS máx.  {status}")
+    return results
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Filtros de color del fotomatón")
+    parser.add_argument('--benchmark', action='store_true', help="Medir el coste por frame de cada filtro")
+    parser.add_argument('--preview', type=parse_size, default=(1280, 720), help="Resolución de vista previa")
+    parser.add_argument('--capture', type=parse_size, default=(1920, 1080), help="Resolución de captura")
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(f"OpenCV {cv2.__version__}, {cv2.getNumThreads()} hilos")
+        benchmark([args.preview, args.capture], args.iterations)
+    else:
+        print("Filtros disponibles: " + ", ".join(FILTERS))
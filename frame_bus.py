@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bus de frames en memoria compartida del fotomatón
+- El proceso principal es el único que abre la cámara; publica cada frame de
+  la vista previa en un anillo de memoria compartida (multiprocessing.shared_memory)
+- Cada ranura lleva una cabecera con número de secuencia, marca de tiempo
+  (time.monotonic, común a todos los procesos) y dimensiones
+- Otros procesos (monitor del encargado, segunda pantalla, grabador) se
+  conectan por nombre y leen el último frame sin copias ni serialización
+- Publicar cuesta una copia del frame; las estadísticas miden ese coste y
+  --benchmark mide también el retraso de los lectores
+
+Uso: python3 frame_bus.py --view | --stats | --benchmark [--size 1280x720 --readers 2]
+"""
+
+import time
+import struct
+import argparse
+from collections import namedtuple
+from multiprocessing import shared_memory
+import numpy as np
+
+DEFAULT_NAME = 'photobooth_frames'
+MAGIC = b'PBFB'
+VERSION = 1
+
+# Cabecera global: magic, versión, ranuras, cerrado, capacidad por ranura, última secuencia
+HEADER_FMT = '<4sIIIQQ'
+HEADER_SIZE = 64
+LATEST_OFFSET = struct.calcsize('<4sIIIQ')
+CLOSED_OFFSET = struct.calcsize('<4sII')
+
+# Cabecera de ranura: secuencia (0 = escribiendo), marca de tiempo, alto, ancho, canales
+SLOT_FMT = '<QdIII'
+SLOT_HEADER_SIZE = 32
+ALIGNMENT = 64
+
+Frame = namedtuple('Frame', 'seq timestamp image')
+
+
+def _align(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _attach(name):
+    """Se conecta a un segmento existente sin que el resource_tracker lo borre al salir."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return shm
+
+
+class FrameBusPublisher:
+    """Lado de la cámara. El segmento se crea con el tamaño del primer frame publicado."""
+    def __init__(self, name=DEFAULT_NAME, slots=3):
+        self.name = name
+        self.slots = max(2, slots)  # Con varias ranuras un lector tiene (slots - 1) frames para usar la suya
+        self.shm = None
+        self.capacity = 0
+        self.seq = 0
+        self.stats = {'published': 0, 'dropped': 0, 'publish_ms': 0.0, 'max_publish_ms': 0.0}
+
+    def _create(self, nbytes):
+        # Un segmento que quedó de una ejecución anterior interrumpida: marcarlo
+        # como cerrado para que los lectores que aún lo tienen se reconecten
+        try:
+            stale = shared_memory.SharedMemory(name=self.name)
+            if stale.size >= HEADER_SIZE and bytes(stale.buf[:len(MAGIC)]) == MAGIC:
+                struct.pack_into('<I', stale.buf, CLOSED_OFFSET, 1)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+
+        self.capacity = _align(nbytes)
+        size = HEADER_SIZE + self.slots * (SLOT_HEADER_SIZE + self.capacity)
+        self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        struct.pack_into(HEADER_FMT, self.shm.buf, 0, MAGIC, VERSION, self.slots, 0, self.capacity, 0)
+        print(f"Bus de frames '{self.name}': {self.slots} ranuras de {self.capacity / (1024 * 1024):.1f} MB")
+
+    def _slot_offset(self, slot):
+        return HEADER_SIZE + slot * (SLOT_HEADER_SIZE + self.capacity)
+
+    def publish(self, frame, timestamp=None):
+        """Copia un frame (uint8, alto x ancho x canales) en la siguiente ranura."""
+        started = time.perf_counter()
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if frame.ndim == 2:
+            frame = frame[:, :, None]
+        if self.shm is None:
+            self._create(frame.nbytes)
+        if frame.nbytes > self.capacity or frame.dtype != np.uint8:
+            self.stats['dropped'] += 1
+            return False
+
+        seq = self.seq + 1
+        offset = self._slot_offset(seq % self.slots)
+        height, width, channels = frame.shape
+        buf = self.shm.buf
+
+        # Secuencia 0 mientras se escribe: un lector que la vea descarta la ranura
+        struct.pack_into(SLOT_FMT, buf, offset, 0, timestamp, height, width, channels)
+        target = np.ndarray(frame.shape, np.uint8, buffer=buf, offset=offset + SLOT_HEADER_SIZE)
+        np.copyto(target, frame)
+        del target
+        struct.pack_into('<Q', buf, offset, seq)
+        struct.pack_into('<Q', buf, LATEST_OFFSET, seq)
+        self.seq = seq
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats['published'] += 1
+        self.stats['publish_ms'] += elapsed_ms
+        self.stats['max_publish_ms'] = max(self.stats['max_publish_ms'], elapsed_ms)
+        return True
+
+    def summary(self):
+        """Frames publicados y coste medio y máximo de publicar."""
+        stats = dict(self.stats)
+        published = stats.pop('publish_ms')
+        stats['avg_publish_ms'] = round(published / stats['published'], 3) if stats['published'] else 0
+        stats['max_publish_ms'] = round(stats['max_publish_ms'], 3)
+        return stats
+
+    def close(self):
+        """Marca el bus como cerrado y borra el segmento."""
+        if self.shm is None:
+            return
+        struct.pack_into('<I', self.shm.buf, CLOSED_OFFSET, 1)
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = None
+
+
+class FrameBusReader:
+    """Lado de los consumidores. Las imágenes son vistas de solo lectura sobre la memoria compartida."""
+    def __init__(self, name=DEFAULT_NAME):
+        self.name = name
+        self.shm = _attach(name)
+        magic, version, self.slots, _, self.capacity, _ = struct.unpack_from(HEADER_FMT, self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError(f"'{name}' no es un bus de frames del fotomatón")
+
+    @property
+    def closed(self):
+        """True si el fotomatón cerró el bus (hay que volver a conectarse)."""
+        return struct.unpack_from('<I', self.shm.buf, CLOSED_OFFSET)[0] == 1
+
+    def _slot_offset(self, seq):
+        return HEADER_SIZE + (seq % self.slots) * (SLOT_HEADER_SIZE + self.capacity)
+
+    def latest_seq(self):
+        return struct.unpack_from('<Q', self.shm.buf, LATEST_OFFSET)[0]
+
+    def latest(self, copy=False):
+        """Último frame publicado o None.
+
+        Sin copy la imagen apunta a la ranura del publicador: sigue siendo
+        válida mientras is_valid(frame) sea True (unos slots - 1 frames).
+        """
+        for _ in range(3):
+            seq = self.latest_seq()
+            if seq == 0:
+                return None
+            offset = self._slot_offset(seq)
+            slot_seq, timestamp, height, width, channels = struct.unpack_from(SLOT_FMT, self.shm.buf, offset)
+            if slot_seq != seq:
+                continue  # Se está reescribiendo: volver a mirar la última
+            image = np.ndarray((height, width, channels), np.uint8,
+                               buffer=self.shm.buf, offset=offset + SLOT_HEADER_SIZE)
+            image.flags.writeable = False
+            frame = Frame(seq, timestamp, image)
+            if copy:
+                frame = Frame(seq, timestamp, image.copy())
+                if not self.is_valid(frame):
+                    continue  # La copia se mezcló con una escritura
+            return frame
+        return None
+
+    def is_valid(self, frame):
+        """True si la ranura del frame no se ha reescrito desde que se leyó."""
+        return struct.unpack_from('<Q', self.shm.buf, self._slot_offset(frame.seq))[0] == frame.seq
+
+    def wait_next(self, last_seq, timeout=1.0, poll_interval=0.002, copy=False):
+        """Espera a un frame más reciente que last_seq. None si se agota el tiempo."""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.latest_seq() > last_seq:
+                frame = self.latest(copy)
+                if frame is not None:
+                    return frame
+            if time.monotonic() >= deadline or self.closed:
+                return None
+            time.sleep(poll_interval)
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # Todavía hay vistas del lector en uso; se libera al salir
+
+
+# ------------------------------------------------------
+# Herramientas de línea de comandos
+# ------------------------------------------------------
+def connect(name, timeout=None):
+    """Conecta con el bus, esperando a que el fotomatón lo cree."""
+    started = time.monotonic()
+    while True:
+        try:
+            return FrameBusReader(name)
+        except FileNotFoundError:
+            if timeout is not None and time.monotonic() - started > timeout:
+                return None
+            time.sleep(1)
+
+
+def follow(name, timeout=1.0, reconnect_after=5):
+    """Frames nuevos del bus, uno tras otro.
+
+    Se reconecta si el fotomatón cierra el bus o tras reconnect_after
+    esperas sin frames (p. ej. si el segmento se sustituyó sin avisar).
+    """
+    reader = connect(name)
+    last, misses = 0, 0
+    try:
+        while True:
+            frame = reader.wait_next(last, timeout)
+            if frame is not None:
+                last, misses = frame.seq, 0
+                yield frame
+                continue
+            misses += 1
+            if reader.closed or misses >= reconnect_after:
+                reader.close()
+                reader, last, misses = connect(name), 0, 0
+    finally:
+        reader.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def view(name):
+    """Monitor del encargado: muestra en una ventana lo que ve la vista previa."""
+    import cv2
+    for frame in follow(name):
+        cv2.imshow('Fotomaton', frame.image)
+        if cv2.waitKey(1) & 0xFF in (27, ord('q')):
+            break
+
+
+def stats(name, seconds):
+    """Frecuencia y retraso del bus en vivo, una línea por segundo."""
+    last, latencies, skipped = 0, [], 0
+    window = time.monotonic()
+    end = window + seconds if seconds else None
+    for frame in follow(name):
+        latencies.append((time.monotonic() - frame.timestamp) * 1000)
+        if last and frame.seq > last:  # Tras reconectar la secuencia vuelve a empezar
+            skipped += frame.seq - last - 1
+        last = frame.seq
+        if time.monotonic() - window >= 1:
+            h, w, c = frame.image.shape
+            print(f"{len(latencies):3d} fps  {w}x{h}x{c}  retraso p50 {percentile(latencies, 50):.2f} ms  "
+                  f"p99 {percentile(latencies, 99):.2f} ms  saltados {skipped}")
+            window, latencies, skipped = time.monotonic(), [], 0
+        if end is not None and time.monotonic() >= end:
+            break
+
+
+def benchmark_reader(name, seconds, results):
+    """Proceso lector del benchmark: retraso, frames saltados y lecturas mezcladas."""
+    reader = connect(name, timeout=5)
+    latencies, skipped, torn, received = [], 0, 0, 0
+    last = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = reader.wait_next(last, timeout=0.5)
+        if frame is None:
+            continue
+        latencies.append((time.monotonic() - frame.timestamp) * 1000)
+        # Usar los datos sin copiarlos y comprobar que la ranura no cambió mientras tanto
+        int(frame.image[::64, ::64].sum())
+        if not reader.is_valid(frame):
+            torn += 1
+        if last:
+            skipped += frame.seq - last - 1
+        last = frame.seq
+        received += 1
+        del frame
+    reader.close()
+    results.put({'received': received, 'skipped': skipped, 'torn': torn,
+                 'latency_p50_ms': percentile(latencies, 50),
+                 'latency_p99_ms': percentile(latencies, 99),
+                 'latency_max_ms': max(latencies) if latencies else 0.0})
+
+
+def benchmark_publisher(name, width, height, fps, seconds, slots, results):
+    """Proceso publicador del benchmark: frames sintéticos al ritmo de la cámara."""
+    frame = np.random.randint(0, 256, (height, width, 3), np.uint8)
+    copy_ms = []
+    for _ in range(50):
+        started = time.perf_counter()
+        frame.copy()
+        copy_ms.append((time.perf_counter() - started) * 1000)
+
+    publisher = FrameBusPublisher(name, slots)
+    period = 1.0 / fps
+    next_frame = time.monotonic()
+    end = next_frame + seconds + 1
+    while time.monotonic() < end:
+        publisher.publish(frame)
+        next_frame += period
+        time.sleep(max(0.0, next_frame - time.monotonic()))
+    publisher.close()
+
+    summary = publisher.summary()
+    summary['copy_ms'] = percentile(copy_ms, 50)
+    results.put(summary)
+
+
+def benchmark(name, width, height, fps, seconds, readers, slots):
+    """Mide publicador y lectores en procesos separados, como en el fotomatón.
+
+    Cada proceso tiene su propio resource_tracker, igual que un monitor
+    lanzado aparte, así que el proceso principal no toca el segmento.
+    """
+    from multiprocessing import Process, Queue
+
+    publisher_results, reader_results = Queue(), Queue()
+    publisher = Process(target=benchmark_publisher,
+                        args=(name, width, height, fps, seconds, slots, publisher_results))
+    publisher.start()
+    processes = [Process(target=benchmark_reader, args=(name, seconds, reader_results)) for _ in range(readers)]
+    for process in processes:
+        process.start()
+
+    summary = publisher_results.get()
+    results = [reader_results.get() for _ in processes]
+    for process in processes + [publisher]:
+        process.join()
+
+    print(f"\nFrames de {width}x{height} a {fps} fps durante {seconds} s, {readers} lectores, {slots} ranuras")
+    print(f"Publicar: media {summary['avg_publish_ms']:.3f} ms, máximo {summary['max_publish_ms']:.3f} ms "
+          f"(una copia en memoria privada: {summary['copy_ms']:.3f} ms, "
+          f"{summary['avg_publish_ms'] * fps / 10:.1f}% de un núcleo)")
+    for i, r in enumerate(results, 1):
+        print(f"Lector {i}: {r['received']} frames, saltados {r['skipped']}, mezclados {r['torn']}, "
+              f"retraso p50 {r['latency_p50_ms']:.2f} ms, p99 {r['latency_p99_ms']:.2f} ms, "
+              f"máx {r['latency_max_ms']:.2f} ms")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bus de frames en memoria compartida del fotomatón")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--view', action='store_true', help="Mostrar la vista previa en una ventana")
+    mode.add_argument('--stats', action='store_true', help="Frecuencia y retraso del bus en vivo")
+    mode.add_argument('--benchmark', action='store_true', help="Medir el coste de publicar y el retraso de lectura")
+    parser.add_argument('--name', default=DEFAULT_NAME)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--size', default='1280x720', help="Tamaño de frame del benchmark (ANCHOxALTO)")
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--slots', type=int, default=3)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.view:
+        view(args.name)
+    elif args.stats:
+        stats(args.name, args.seconds)
+    else:
+        width, height = (int(v) for v in args.size.lower().split('x'))
+        # Nombre propio para no chocar con un fotomatón en marcha
+        benchmark(args.name + '_bench', width, height, args.fps, args.seconds, args.readers, args.slots)
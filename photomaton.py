@@ -22,20 +22,20 @@ from PIL import Image, ImageEnhance, ImageOps, ImageDraw, ImageFont
 import cups
 import numpy as np
 import threading
-import yaml
 import os.path
 import tempfile
+import signal
+from booth_settings import (
+    settings, get_save_directory, TOTAL_PHOTOS, SESSION_ACTIVE_FLAG,
+)
+from session_journal import SessionJournal
+from filters import FILTERS, get_filter
+from printer_pool import PrinterPool
+from encoder import OutputEncoder
+from profiler import PhaseProfiler
+from staging import StagingArea
+from frame_bus import FrameBusPublisher
 
-# Load the YAML settings file
-try:
-    with open('settings.yml', 'r') as file:
-        settings = yaml.safe_load(file)
-        print(f"Settings successfully loaded from {file.name}")
-        
-except Exception as e:
-    print(f"Error loading settings file from {file.name}: {e}")
-    print("Using default settings.")
-    settings = {}
 # ------------------------------------------------------
 # Settings
 # ------------------------------------------------------
@@ -52,7 +52,11 @@ BLINK_SPEED = settings.get('BLINK_SPEED', 500)     # Velocidad de parpadeo en mi
 # Configuración de tiempos para las 3 fotos
 INITIAL_COUNTDOWN_TIME = settings.get('INITIAL_COUNTDOWN_TIME', 5)  # Tiempo inicial antes de la primera foto
 BETWEEN_PHOTOS_TIME = settings.get('BETWEEN_PHOTOS_TIME', 2)  # Tiempo entre fotos
-TOTAL_PHOTOS = 3  # Número total de fotos a tomar
+
+# Tiempo de revisión de las fotos y modo encadenado
+SHOW_PHOTOS_TIME = settings.get('SHOW_PHOTOS_TIME', 8)          # Segundos mostrando las 3 fotos
+PIPELINE_SESSIONS = settings.get('PIPELINE_SESSIONS', False)    # Encadenar sesiones si hay créditos esperando
+PIPELINE_REVIEW_TIME = settings.get('PIPELINE_REVIEW_TIME', 2)  # Revisión acortada con créditos (0 = saltar)
 
 # Configuración para imagen compuesta
 COMPOSITE_SPACING = settings.get('COMPOSITE_SPACING', 10)  # Espacio entre fotos reducido para tira
@@ -66,8 +70,24 @@ DNP_STRIP_HEIGHT = settings.get('DNP_STRIP_HEIGHT', 1240)  # Alto en píxeles pa
 DNP_PHOTO_SPACING = settings.get('DNP_PHOTO_SPACING', 5)   # Espaciado mínimo entre fotos en tira
 DNP_PRINT_SIZE = settings.get('DNP_PRINT_SIZE', '2x6')     # Tamaño de impresión: '2x6', '4x6', '5x7', etc.
 
+# Grupo de impresoras (ver printer_pool.py)
+PRINTER_NAMES = settings.get('PRINTER_NAMES', None)      # Lista de colas CUPS a usar (None = todas)
+PRINTER_MATCH = settings.get('PRINTER_MATCH', None)      # Usar solo colas cuyo nombre contenga este texto (p. ej. 'DNP')
+PRINTER_POLL_INTERVAL = settings.get('PRINTER_POLL_INTERVAL', 5)  # Segundos entre comprobaciones de estado
+
 COIN_PIN = settings.get('COIN_PIN', 17)  # El pin GPIO donde está conectado el detector de monedas
 LED_PIN = settings.get('LED_PIN', 27)   # Pin para un LED opcional
+FILTER_BUTTON_PIN = settings.get('FILTER_BUTTON_PIN', None)  # Pin opcional de un botón para cambiar de filtro
+
+# Filtros de color (ver filters.py): se eligen en la pantalla de espera con las flechas o el botón
+FILTERS_ENABLED = settings.get('FILTERS_ENABLED', list(FILTERS.keys()))
+DEFAULT_FILTER = settings.get('DEFAULT_FILTER', 'normal')
+
+# Configuración de la cámara (medir con shutter_latency.py)
+CAMERA_INDEX = settings.get('CAMERA_INDEX', 0)
+CAMERA_FOURCC = settings.get('CAMERA_FOURCC', None)              # Formato de píxel, p. ej. 'MJPG' o 'YUYV'
+CAMERA_BUFFER_SIZE = settings.get('CAMERA_BUFFER_SIZE', None)    # Profundidad de la cola V4L2 (1 = mínimo retraso)
+CAMERA_DRAIN_FRAMES = settings.get('CAMERA_DRAIN_FRAMES', 0)     # Frames antiguos a descartar antes de cada foto
 
 # Configuración de la pantalla
 SCREEN_WIDTH = settings.get('SCREEN_WIDTH', 1280)
@@ -83,6 +103,32 @@ FRAME_INNER_THICKNESS = settings.get('FRAME_INNER_THICKNESS', 5)  # Grosor del b
 FRAME_ROUNDED = settings.get('FRAME_ROUNDED', True)  # Si quieres que el marco tenga esquinas redondeadas
 FRAME_CORNER_RADIUS = settings.get('FRAME_CORNER_RADIUS', 20)  # Radio de las esquinas redondeadas (si FRAME_ROUNDED es True)
 
+# Área local de preparación (ver staging.py): las sesiones se escriben aquí y se vuelcan al pendrive
+STAGING_ENABLED = settings.get('STAGING_ENABLED', True)
+STAGING_DIR = settings.get('STAGING_DIR', 'staging')                 # Tarjeta SD o un tmpfs (p. ej. /dev/shm/photobooth)
+STAGING_MAX_BYTES = settings.get('STAGING_MAX_BYTES', 2 * 1024 ** 3) # Tamaño máximo antes de borrar sesiones ya volcadas
+STAGING_FLUSH_INTERVAL = settings.get('STAGING_FLUSH_INTERVAL', 10)  # Segundos entre intentos de volcado
+STAGING_SESSION_BYTES = settings.get('STAGING_SESSION_BYTES', 16 * 1024 ** 2)  # Espacio reservado por sesión
+
+# Diario de sesiones para recuperar una sesión tras un reinicio
+JOURNAL_PATH = settings.get('JOURNAL_PATH', 'session_journal.log')
+JOURNAL_MAX_BYTES = settings.get('JOURNAL_MAX_BYTES', 64 * 1024)  # Tamaño a partir del cual se compacta
+
+# Etapa de codificación (ver encoder.py): perfiles 'archive' (fotos, JPEG o WebP) y 'strip' (tira, siempre JPEG)
+# Ejemplo en settings.yml:  ENCODE_PROFILES: {strip: {quality: 98}, archive: {progressive: true}}
+ENCODE_PROFILES = settings.get('ENCODE_PROFILES', {})
+ENCODE_WORKERS = settings.get('ENCODE_WORKERS', os.cpu_count() or 1)
+
+# Perfilado bajo demanda (ver profiler.py): kill -USR1 <pid> abre una ventana de perfilado
+PROFILE_AT_STARTUP = settings.get('PROFILE_AT_STARTUP', False)  # Perfilar nada más arrancar
+PROFILE_WINDOW = settings.get('PROFILE_WINDOW', 60)             # Duración de la ventana en segundos
+PROFILE_TRACEMALLOC = settings.get('PROFILE_TRACEMALLOC', True) # Instantáneas de memoria con tracemalloc
+
+# Bus de frames en memoria compartida (ver frame_bus.py) para monitores y grabadores externos
+FRAME_BUS_ENABLED = settings.get('FRAME_BUS_ENABLED', False)
+FRAME_BUS_NAME = settings.get('FRAME_BUS_NAME', 'photobooth_frames')
+FRAME_BUS_SLOTS = settings.get('FRAME_BUS_SLOTS', 3)   # Ranuras del anillo: más ranuras, más margen para lectores lentos
+
 # Configuración de colores
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
@@ -101,47 +147,16 @@ RETRO_FONT_PATH = os.path.join(FONT_DIR, RETRO_FONT)
 # Usar fuente alternativa si la principal no está disponible
 USE_FALLBACK_FONT = True  # Cambiar a False para usar solo fuentes de sistema si la retro falla
 
-# Configuración de directorios - ahora se determina dinámicamente
-def get_save_directory():
-    """Detecta si hay un pendrive USB y devuelve la ruta de guardado."""
-    # Directorios comunes donde se montan dispositivos USB en Raspberry Pi/Linux
-    usb_mount_paths = [
-        '/media/pi',      # Raspberry Pi OS
-        '/media',         # Sistemas Linux generales
-        '/mnt',           # Montajes manuales
-        '/run/media'      # Algunas distribuciones
-    ]
-    
-    for base_path in usb_mount_paths:
-        if os.path.exists(base_path):
-            try:
-                # Buscar subdirectorios (dispositivos montados)
-                for item in os.listdir(base_path):
-                    usb_path = os.path.join(base_path, item)
-                    if os.path.isdir(usb_path):
-                        # Verificar si podemos escribir en el directorio
-                        test_file = os.path.join(usb_path, '.photobooth_test')
-                        try:
-                            with open(test_file, 'w') as f:
-                                f.write('test')
-                            os.remove(test_file)
-                            
-                            # Crear carpeta para fotos en el pendrive
-                            photobooth_dir = os.path.join(usb_path, 'photobooth_images')
-                            if not os.path.exists(photobooth_dir):
-                                os.makedirs(photobooth_dir)
-                            
-                            print(f"Pendrive USB detectado: {usb_path}")
-                            return photobooth_dir
-                        except (PermissionError, OSError):
-                            # No se puede escribir, continuar buscando
-                            continue
-            except (PermissionError, OSError):
-                # No se puede acceder al directorio, continuar
-                continue
-    
-    print("No se detectó ningún pendrive USB con permisos de escritura")
-    return None
+def set_session_active(active):
+    """Crea o elimina el fichero que marca una sesión en curso."""
+    try:
+        if active:
+            with open(SESSION_ACTIVE_FLAG, 'w') as f:
+                f.write(str(os.getpid()))
+        elif os.path.exists(SESSION_ACTIVE_FLAG):
+            os.remove(SESSION_ACTIVE_FLAG)
+    except OSError as e:
+        print(f"Error al actualizar el indicador de sesión activa: {e}")
 
 class PhotoboothGUI:
     def __init__(self):
@@ -150,6 +165,8 @@ class PhotoboothGUI:
         GPIO.setup(COIN_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
         GPIO.setup(LED_PIN, GPIO.OUT)
         GPIO.output(LED_PIN, GPIO.LOW)
+        if FILTER_BUTTON_PIN is not None:
+            GPIO.setup(FILTER_BUTTON_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
         
         # Inicializar Pygame
         pygame.init()
@@ -213,6 +230,19 @@ class PhotoboothGUI:
         self.camera = None
         self.connect_camera()
         
+        # Perfilado bajo demanda: la señal solo arma el perfilador, el bucle principal hace el resto
+        self.profiler = PhaseProfiler(PROFILE_WINDOW, PROFILE_TRACEMALLOC, get_save_directory)
+        signal.signal(signal.SIGUSR1, self.profiler.request)
+        if PROFILE_AT_STARTUP:
+            self.profiler.request()
+        
+        # Codificación de imágenes en paralelo
+        self.encoder = OutputEncoder(ENCODE_PROFILES, ENCODE_WORKERS)
+        self.pending_encodes = []  # Fotos de la sesión actual que se están guardando
+        
+        # Publicar la vista previa para otros procesos (la cámara solo se puede abrir aquí)
+        self.frame_bus = FrameBusPublisher(FRAME_BUS_NAME, FRAME_BUS_SLOTS) if FRAME_BUS_ENABLED else None
+        
         # Variables de estado para secuencia de 3 fotos
         self.running = True
         self.current_state = "waiting_coin"  # Estados: waiting_coin, initial_countdown, taking_photos, show_photos
@@ -222,22 +252,39 @@ class PhotoboothGUI:
         self.taken_photos = []  # Lista para almacenar las fotos tomadas
         self.session_timestamp = None  # Timestamp de la sesión actual
         self.save_dir = None  # Directorio donde se guardarán las fotos (determinado dinámicamente)
-        self.usb_available = False  # Flag para saber si hay USB disponible
+        self.storage_available = False  # Flag para saber si hay dónde guardar las fotos
+        
+        # Créditos: las monedas se acumulan en cualquier momento y cada sesión gasta una
+        self.credits = 0
+        self.credits_lock = threading.Lock()
+        self.coins_inserted = 0  # Total de monedas desde el arranque
+        self.sessions_started = 0  # Total de sesiones desde el arranque
+        self.last_session_timestamp = None  # Para no repetir timestamp de sesión
+        self.session_suffix = 1
 
+        # Filtro de color seleccionado
+        self.filters = [get_filter(name) for name in FILTERS_ENABLED] or [get_filter('normal')]
+        self.filter_index = 0
+        for i, color_filter in enumerate(self.filters):
+            if color_filter.name == DEFAULT_FILTER:
+                self.filter_index = i
+        
         # Para el efecto de parpadeo
         self.blink_visible = True
         self.last_blink_time = pygame.time.get_ticks()
         
-        # Configuración de impresora
-        self.printer_name = None
+        # Configuración de impresoras: todas las colas CUPS adecuadas forman un grupo
+        self.printer_pool = None
         try:
             self.conn = cups.Connection()
-            self.printers = self.conn.getPrinters()
+            # Si un trabajo se reenvía a otra impresora, el diario sigue al nuevo
+            self.printer_pool = PrinterPool(self.conn, PRINTER_NAMES, PRINTER_MATCH, PRINTER_POLL_INTERVAL,
+                                            on_resubmit=lambda session, printer, job_id:
+                                                self.journal.job(session, printer, job_id))
             
-            # Si hay impresoras disponibles, usar la primera
-            if self.printers:
-                self.printer_name = list(self.printers.keys())[0]
-                print(f"Impresora encontrada: {self.printer_name}")
+            if self.printer_pool.printers:
+                print(f"Impresoras encontradas: {', '.join(self.printer_pool.printers)}")
+                self.printer_pool.start_monitor()
             else:
                 print("No se encontraron impresoras. Las fotos se guardarán pero no se imprimirán.")
         except Exception as e:
@@ -245,6 +292,23 @@ class PhotoboothGUI:
             print("El sistema de impresión no está disponible. Las fotos se guardarán pero no se imprimirán.")
             self.conn = None
         
+        # Área local de preparación con volcado al pendrive en segundo plano
+        self.staging = None
+        if STAGING_ENABLED:
+            try:
+                self.staging = StagingArea(STAGING_DIR, STAGING_MAX_BYTES, get_save_directory,
+                                           is_busy=lambda: self.current_state != "waiting_coin",
+                                           flush_interval=STAGING_FLUSH_INTERVAL,
+                                           session_bytes=STAGING_SESSION_BYTES)
+                self.staging.start()
+                print(f"Área local de preparación: {os.path.abspath(STAGING_DIR)}")
+            except OSError as e:
+                print(f"Error al crear el área local '{STAGING_DIR}': {e}. Se guardará directamente en el pendrive.")
+        
+        # Diario de sesiones: recuperar la sesión pendiente si el proceso murió a medias
+        self.journal = SessionJournal(JOURNAL_PATH, JOURNAL_MAX_BYTES)
+        self.recover_session()
+        
         # Crear un thread para la detección de monedas
         self.coin_thread = threading.Thread(target=self.coin_detection_loop)
         self.coin_thread.daemon = True
@@ -318,11 +382,17 @@ class PhotoboothGUI:
     def connect_camera(self):
         """Conecta a la webcam."""
         try:
-            self.camera = cv2.VideoCapture(0)
+            self.camera = cv2.VideoCapture(CAMERA_INDEX)
             if not self.camera.isOpened():
                 print("Error: No se pudo abrir la cámara.")
                 return False
             
+            # Formato de píxel y profundidad de la cola de buffers
+            if CAMERA_FOURCC:
+                self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*CAMERA_FOURCC))
+            if CAMERA_BUFFER_SIZE:
+                self.camera.set(cv2.CAP_PROP_BUFFERSIZE, CAMERA_BUFFER_SIZE)
+            
             # Configurar resolución
             self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, SCREEN_WIDTH)
             self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, SCREEN_HEIGHT)
@@ -344,6 +414,13 @@ class PhotoboothGUI:
         # Invertir horizontalmente la imagen para efecto espejo en la vista previa
         frame = cv2.flip(frame, 1)  # 1 = voltear horizontalmente, 0 = voltear verticalmente
         
+        # Aplicar el filtro de color seleccionado
+        frame = self.current_filter.apply(frame)
+        
+        # Compartir el frame tal como se muestra (espejo y filtro, en BGR)
+        if self.frame_bus is not None:
+            self.frame_bus.publish(frame)
+        
         # Convertir de OpenCV (BGR) a Pygame (RGB)
         frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         frame = np.rot90(frame)  # Rotar si es necesario
@@ -356,55 +433,38 @@ class PhotoboothGUI:
             print("La cámara no está disponible.")
             return None
         
+        # Descartar frames que ya estaban en la cola antes del flash
+        for _ in range(CAMERA_DRAIN_FRAMES):
+            self.camera.grab()
+        
         # Capturar imagen
         ret, frame = self.camera.read()
         if not ret:
             print("Error al capturar la imagen.")
             return None
         
-        # Solo procesar y guardar si hay USB disponible
-        if not self.usb_available:
-            print(f"Foto {self.photos_taken + 1} tomada pero no guardada (no hay USB)")
-            # Crear imagen temporal solo para mostrar en pantalla
-            import tempfile
-            temp_dir = tempfile.gettempdir()
-            if self.session_timestamp is None:
-                self.session_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            
-            temp_filename = f"temp_photo_{self.photos_taken + 1}.jpg"
-            temp_filepath = os.path.join(temp_dir, temp_filename)
-            
-            # Guardar temporalmente para mostrar
-            cv2.imwrite(temp_filepath, frame)
-            
-            # Convertir para pygame sin procesar con PIL
-            pygame_image = pygame.image.load(temp_filepath)
-            pygame_image = pygame.transform.scale(pygame_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
-            
-            # Agregar a la lista de fotos tomadas
-            self.taken_photos.append(pygame_image)
-            self.photos_taken += 1
-            
-            # Eliminar archivo temporal
-            try:
-                os.remove(temp_filepath)
-            except:
-                pass
-                
-            return None  # No hay archivo permanente
+        # Aplicar el filtro de color seleccionado a resolución completa
+        frame = self.current_filter.apply(frame)
         
-        # Generar nombre de archivo con timestamp de la sesión y número de foto
         if self.session_timestamp is None:
             self.session_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        filename = f"photobooth_{self.session_timestamp}_foto{self.photos_taken + 1}.jpg"
-        filepath = os.path.join(self.save_dir, filename)
+        # Solo procesar y guardar si hay dónde guardar
+        if not self.storage_available:
+            print(f"Foto {self.photos_taken + 1} tomada pero no guardada (no hay almacenamiento)")
+            # Convertir para pygame sin procesar con PIL ni pasar por disco
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            self.taken_photos.append(self.to_display_surface(rgb))
+            self.photos_taken += 1
+            return None  # No hay archivo permanente
         
-        # Guardar imagen original
-        cv2.imwrite(filepath, frame)
+        # Generar nombre de archivo con timestamp de la sesión y número de foto
+        index = self.photos_taken + 1
+        filename = f"photobooth_{self.session_timestamp}_foto{index}{self.encoder.extension('archive')}"
+        filepath = os.path.join(self.save_dir, filename)
         
-        # Mejorar y aplicar filtros a la imagen con PIL
-        image = Image.open(filepath)
+        # Mejorar y aplicar filtros a la imagen con PIL (en memoria, sin guardar el original)
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
         
         # Ajustes básicos: brillo, contraste y saturación
         image = ImageEnhance.Brightness(image).enhance(1.2)
@@ -413,34 +473,47 @@ class PhotoboothGUI:
         
         # Añadir un borde 
         image = ImageOps.expand(image, border=PICTURE_BORDER_SIZE, fill=PICTURE_BORDER_COLOR)
+        rgb = np.asarray(image)
         
-        # Guardar imagen modificada
-        image.save(filepath)
-        print(f"Foto {self.photos_taken + 1} guardada como {filepath}")
+        # Guardar imagen modificada en segundo plano; el diario la registra cuando está en disco
+        future = self.encoder.submit(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), filepath, 'archive')
+        session = self.session_timestamp
+        def on_saved(done):
+            if done.exception() is None:
+                print(f"Foto {index} guardada como {filepath}")
+                self.journal.photo(session, index, filepath)
+        future.add_done_callback(on_saved)
+        self.pending_encodes.append(future)
         
         # Convertir la imagen para mostrarla en pygame
-        pygame_image = pygame.image.load(filepath)
-        pygame_image = pygame.transform.scale(pygame_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
-        
-        # Agregar a la lista de fotos tomadas
-        self.taken_photos.append(pygame_image)
+        self.taken_photos.append(self.to_display_surface(rgb))
         self.photos_taken += 1
         
         return filepath
     
-    def create_composite_image(self):
-        """Crea una imagen compuesta optimizada para DNP DS620 en formato tira."""
-        # Solo crear imagen compuesta si hay USB y se guardaron las fotos
-        if not self.usb_available or not self.save_dir:
-            print("No se creará imagen compuesta: no hay USB disponible")
+    def to_display_surface(self, rgb):
+        """Convierte una imagen RGB (numpy) en una superficie de pygame a tamaño de pantalla."""
+        height, width = rgb.shape[:2]
+        surface = pygame.image.frombuffer(np.ascontiguousarray(rgb).tobytes(), (width, height), 'RGB')
+        return pygame.transform.scale(surface, (SCREEN_WIDTH, SCREEN_HEIGHT))
+    
+    def create_composite_image(self, session_timestamp, save_dir):
+        """Crea una imagen compuesta optimizada para DNP DS620 en formato tira.
+        
+        Recibe la sesión explícitamente porque en modo encadenado la siguiente
+        sesión puede haber empezado mientras se compone esta tira.
+        """
+        # Solo crear imagen compuesta si se guardaron las fotos
+        if not save_dir:
+            print("No se creará imagen compuesta: no hay almacenamiento disponible")
             return None
             
         try:
             # Cargar las 3 imágenes individuales
             images = []
             for i in range(TOTAL_PHOTOS):
-                photo_path = f"photobooth_{self.session_timestamp}_foto{i+1}.jpg"
-                full_path = os.path.join(self.save_dir, photo_path)
+                photo_path = f"photobooth_{session_timestamp}_foto{i+1}{self.encoder.extension('archive')}"
+                full_path = os.path.join(save_dir, photo_path)
                 if os.path.exists(full_path):
                     img = Image.open(full_path)
                     images.append(img)
@@ -492,9 +565,10 @@ class PhotoboothGUI:
                 print(f"Foto {i+1} colocada en posición ({x_position - photo_width - spacing}, {start_y})")
             
             # Guardar la imagen de tira
-            strip_filename = f"photobooth_{self.session_timestamp}_tira_dnp.jpg"
-            strip_path = os.path.join(self.save_dir, strip_filename)
-            strip_image.save(strip_path, 'JPEG', quality=100, dpi=(300, 300))
+            strip_filename = f"photobooth_{session_timestamp}_tira_dnp{self.encoder.extension('strip')}"
+            strip_path = os.path.join(save_dir, strip_filename)
+            strip_bgr = cv2.cvtColor(np.asarray(strip_image), cv2.COLOR_RGB2BGR)
+            self.encoder.write(strip_bgr, strip_path, 'strip', dpi=300)
             
             print(f"Tira DNP creada: {strip_path}")
             print(f"Dimensiones de tira: {strip_width}x{strip_height}")
@@ -505,21 +579,46 @@ class PhotoboothGUI:
             print(f"Error al crear tira DNP: {e}")
             return None
 
+    def printing_available(self):
+        """Indica si hay al menos una impresora en el grupo."""
+        return self.conn is not None and self.printer_pool is not None and bool(self.printer_pool.printers)
+    
     def print_photos(self):
         """Crea una tira e imprime en DNP DS620."""
-        if not self.usb_available:
-            print("No se imprimirá: no hay USB disponible")
+        session = self.session_timestamp
+        # Las fotos de esta sesión pueden estar todavía codificándose
+        pending_encodes, self.pending_encodes = self.pending_encodes, []
+        if not self.storage_available:
+            print("No se imprimirá: no hay almacenamiento disponible")
+            self.finish_session(session, 'sin_almacenamiento')
             return False
-            
-        if not self.printer_name or not self.conn:
+        
+        return self.print_session(session, self.save_dir, pending_encodes)
+    
+    def print_session(self, session, save_dir, pending_encodes=()):
+        """Compone e imprime en segundo plano la tira de una sesión ya terminada."""
+        if not self.printing_available():
             print("Sistema de impresión no disponible. Las fotos se guardarán sin imprimir.")
+            # No marcar la sesión como terminada hasta que la última foto esté en disco,
+            # esperando en otro hilo como en la impresión para no congelar la pantalla
+            def finish_unprinted():
+                self.encoder.wait(pending_encodes)
+                self.finish_session(session, 'sin_impresora')
+            finish_thread = threading.Thread(target=finish_unprinted)
+            finish_thread.daemon = True
+            finish_thread.start()
             return False
         
         def print_strip():
+            status = 'error'
             try:
+                # Esperar a que las fotos estén en disco antes de componer la tira
+                self.encoder.wait(pending_encodes)
+                
                 # Crear tira para DNP DS620
-                strip_path = self.create_composite_image()
+                strip_path = self.create_composite_image(session, save_dir)
                 if strip_path and os.path.exists(strip_path):
+                    self.journal.strip(session, strip_path)
                     print(f"Imprimiendo tira en DNP DS620: {strip_path}")
                     
                     # Opciones específicas para DNP DS620
@@ -535,54 +634,213 @@ class PhotoboothGUI:
                         'Duplex': 'None'                   # Sin impresión duplex
                     }
                     
-                    # Enviar trabajo de impresión con opciones específicas
-                    job_id = self.conn.printFile(
-                        self.printer_name, 
+                    # Enviar trabajo de impresión a la impresora menos cargada del grupo
+                    printer, job_id = self.printer_pool.submit(
                         strip_path, 
                         "Photobooth Strip DNP DS620", 
-                        print_options
+                        print_options,
+                        tag=session
                     )
-                    print(f"Trabajo de impresión DNP enviado. ID: {job_id}")
-                    print(f"Opciones de impresión: {print_options}")
+                    if job_id is not None:
+                        print(f"Trabajo de impresión DNP enviado a {printer}. ID: {job_id}")
+                        print(f"Opciones de impresión: {print_options}")
+                        self.journal.job(session, printer, job_id)
+                        status = 'impresa'
                 else:
                     print("No se pudo crear la tira para imprimir")
             except Exception as e:
                 print(f"Error al imprimir en DNP DS620: {e}")
+            finally:
+                self.finish_session(session, status)
         
         # Iniciar la impresión en un hilo separado para no bloquear la interfaz
         print_thread = threading.Thread(target=print_strip)
         print_thread.daemon = True
         print_thread.start()
+        return True
+    
+    def finish_session(self, session, status):
+        """Cierra la sesión en el diario y la deja lista para volcar al pendrive."""
+        # Primero el marcador: si se corta antes de cerrar el diario, la recuperación lo repite
+        if self.staging is not None:
+            self.staging.mark_complete(session)
+        self.journal.end(session, status)
+    
+    @property
+    def current_filter(self):
+        """Filtro de color activo."""
+        return self.filters[self.filter_index]
+    
+    def select_next_filter(self, step=1):
+        """Cambia de filtro (solo en la pantalla de espera)."""
+        if self.current_state != "waiting_coin":
+            return
+        self.filter_index = (self.filter_index + step) % len(self.filters)
+        print(f"Filtro seleccionado: {self.current_filter.name}")
+    
+    def add_credit(self):
+        """Suma un crédito. Se puede llamar en cualquier estado."""
+        with self.credits_lock:
+            self.credits += 1
+            self.coins_inserted += 1
+            credits = self.credits
+            # En el diario dentro del cerrojo para que los registros no se desordenen
+            self.journal.credits(credits)
+        print(f"¡Moneda detectada! Créditos: {credits}")
+    
+    def consume_credit(self):
+        """Gasta un crédito si hay alguno. Devuelve True si se ha gastado."""
+        with self.credits_lock:
+            if self.credits <= 0:
+                return False
+            self.credits -= 1
+            self.journal.credits(self.credits)
+        return True
     
     def coin_detection_loop(self):
         """Bucle de detección de monedas en un hilo separado."""
+        filter_button_pressed = False
+        coin_present = False
         while self.running:
-            if self.current_state == "waiting_coin" and GPIO.input(COIN_PIN) == GPIO.HIGH:
-                print("¡Moneda detectada! Iniciando secuencia de 3 fotos...")
+            # Botón opcional de cambio de filtro (detección de flanco)
+            if FILTER_BUTTON_PIN is not None:
+                pressed = GPIO.input(FILTER_BUTTON_PIN) == GPIO.HIGH
+                if pressed and not filter_button_pressed:
+                    self.select_next_filter()
+                filter_button_pressed = pressed
+            # Cada flanco de subida del detector es una moneda, en cualquier estado
+            coin = GPIO.input(COIN_PIN) == GPIO.HIGH
+            if coin and not coin_present:
                 GPIO.output(LED_PIN, GPIO.HIGH)  # Encender LED
-                self.start_photo_sequence()
+                self.add_credit()
                 # Esperar un momento para evitar rebotes
                 time.sleep(0.2)
                 GPIO.output(LED_PIN, GPIO.LOW)  # Apagar LED
-            time.sleep(0.1)  # Pequeña pausa para no saturar la CPU
+                coin = GPIO.input(COIN_PIN) == GPIO.HIGH
+            coin_present = coin
+            time.sleep(0.02)  # Pausa corta para no perder pulsos de monedas
     
     def start_photo_sequence(self):
         """Inicia la secuencia de 3 fotos."""
-        # Detectar si hay pendrive USB disponible
-        self.save_dir = get_save_directory()
-        self.usb_available = self.save_dir is not None
+        self.session_timestamp = self.new_session_timestamp()
+        
+        # Las fotos van primero al área local; sin ella, directamente al pendrive si lo hay
+        if self.staging is not None:
+            # Si no cabe otra sesión se usa solo para imprimir y se borra después
+            transient = not self.staging.has_room()
+            if transient:
+                print("Área local llena: las fotos de esta sesión se imprimirán pero no se guardarán")
+            self.save_dir = self.staging.session_dir(self.session_timestamp, transient)
+        else:
+            self.save_dir = get_save_directory()
+        self.storage_available = self.save_dir is not None
         
-        if self.usb_available:
-            print(f"USB detectado. Las fotos se guardarán en: {self.save_dir}")
+        if self.storage_available:
+            print(f"Las fotos se guardarán en: {self.save_dir}")
         else:
             print("No se detectó USB. Las fotos serán temporales y no se guardarán.")
         
+        print("Iniciando secuencia de 3 fotos...")
+        set_session_active(True)
         self.current_state = "initial_countdown"
         self.countdown_value = INITIAL_COUNTDOWN_TIME
+        self.last_countdown_time = pygame.time.get_ticks()
         self.photos_taken = 0
         self.taken_photos = []
-        self.session_timestamp = None
         self.current_photo_countdown = 0
+        self.sessions_started += 1
+        self.journal.coin(self.session_timestamp, self.save_dir)
+    
+    def new_session_timestamp(self):
+        """Timestamp de sesión único aunque dos sesiones empiecen en el mismo segundo."""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if timestamp == self.last_session_timestamp:
+            self.session_suffix += 1
+            return f"{timestamp}_{self.session_suffix}"
+        self.last_session_timestamp = timestamp
+        self.session_suffix = 1
+        return timestamp
+    
+    def recover_session(self):
+        """Recupera los créditos y la sesión que quedó sin terminar según el diario de sesiones."""
+        sessions, self.credits = self.journal.recover()
+        if self.staging is not None:
+            self.staging.reconcile({state['session'] for state in sessions})
+        if self.credits:
+            print(f"Créditos recuperados: {self.credits}")
+        if not sessions:
+            # Un indicador de sesión activa que quedó de una ejecución anterior
+            set_session_active(False)
+            return
+        
+        # En modo encadenado puede quedar abierta más de una sesión: las anteriores
+        # a la última ya habían terminado sus fotos y solo les falta imprimir
+        for previous in sessions[:-1]:
+            self.recover_print(previous)
+        
+        state = sessions[-1]
+        session = state['session']
+        print(f"Recuperando sesión interrumpida {session}")
+        
+        # La impresión ya se envió: no hay nada más que hacer
+        if state['job'] is not None:
+            print(f"La tira de la sesión {session} ya se envió a imprimir (trabajo {state['job']})")
+            self.finish_session(session, 'recuperada')
+            return
+        
+        self.session_timestamp = session
+        self.save_dir = state['save_dir']
+        self.storage_available = bool(self.save_dir) and os.path.isdir(self.save_dir)
+        
+        # Cargar las fotos que llegaron a guardarse, en orden y sin huecos
+        self.taken_photos = []
+        self.photos_taken = 0
+        if self.storage_available:
+            for index in range(1, TOTAL_PHOTOS + 1):
+                filepath = state['photos'].get(index)
+                if not filepath or not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+                    break
+                try:
+                    pygame_image = pygame.image.load(filepath)
+                except pygame.error as e:
+                    print(f"Foto {index} de la sesión {session} ilegible: {e}")
+                    break
+                self.taken_photos.append(pygame.transform.scale(pygame_image, (SCREEN_WIDTH, SCREEN_HEIGHT)))
+                self.photos_taken += 1
+        
+        set_session_active(True)
+        if self.photos_taken >= TOTAL_PHOTOS:
+            # Todas las fotos están guardadas: crear la tira e imprimir
+            print(f"Sesión {session} completa. Reanudando impresión...")
+            self.print_photos()
+            self.current_state = "show_photos"
+            self.photo_display_start = pygame.time.get_ticks()
+        elif self.photos_taken > 0:
+            # Ofrecer las fotos que faltan
+            print(f"Sesión {session}: {self.photos_taken} fotos recuperadas, faltan {TOTAL_PHOTOS - self.photos_taken}")
+            self.current_state = "taking_photos"
+            self.current_photo_countdown = INITIAL_COUNTDOWN_TIME
+            self.last_photo_countdown_time = pygame.time.get_ticks()
+        else:
+            # No se guardó ninguna foto: repetir la sesión completa
+            print(f"Sesión {session}: no hay fotos guardadas, se repite la sesión")
+            self.current_state = "initial_countdown"
+            self.countdown_value = INITIAL_COUNTDOWN_TIME
+            self.last_countdown_time = pygame.time.get_ticks()
+    
+    def recover_print(self, state):
+        """Reenvía a imprimir una sesión anterior que quedó a medias."""
+        session, save_dir = state['session'], state['save_dir']
+        if state['job'] is not None:
+            self.finish_session(session, 'recuperada')
+            return
+        photos = [state['photos'].get(index) for index in range(1, TOTAL_PHOTOS + 1)]
+        if save_dir and all(path and os.path.exists(path) for path in photos):
+            print(f"Sesión {session} completa. Reanudando impresión...")
+            self.print_session(session, save_dir)
+        else:
+            print(f"Sesión {session}: faltan fotos, no se puede imprimir")
+            self.finish_session(session, 'perdida')
     
     def draw_waiting_screen(self):
         """Dibuja la pantalla de espera de moneda."""
@@ -626,6 +884,19 @@ class PhotoboothGUI:
             text2 = self.font_medium.render(SCREEN_SUBTITLE, True, WHITE)
             text2_rect = text2.get_rect(center=(SCREEN_WIDTH//2, SCREEN_HEIGHT//2 + 50))
             self.screen.blit(text2, text2_rect)
+        
+        # Filtro de color seleccionado
+        if len(self.filters) > 1:
+            filter_text = self.font_small.render(f"< {self.current_filter.label} >", True, YELLOW)
+            filter_rect = filter_text.get_rect(center=(SCREEN_WIDTH//2, SCREEN_HEIGHT//2 + 150))
+            self.screen.blit(filter_text, filter_rect)
+        
+        # Aviso para el encargado si las fotos se acumulan sin pendrive
+        staging_message = self.staging.status_message() if self.staging is not None else None
+        if staging_message:
+            warning_text = self.font_small.render(staging_message, True, RED)
+            warning_rect = warning_text.get_rect(center=(SCREEN_WIDTH//2, SCREEN_HEIGHT - FRAME_THICKNESS - 40))
+            self.screen.blit(warning_text, warning_rect)
             
         # Dibujar el marco por encima de todo
         self.draw_frame()
@@ -744,22 +1015,30 @@ class PhotoboothGUI:
                 num_text = self.font_small.render(f"{i+1}", True, WHITE)
                 self.screen.blit(num_text, (x_pos + 10, start_y + 10))
         
-        # Mostrar estado según disponibilidad de USB
-        if self.usb_available:
-            if self.printer_name and self.conn:
-                text = self.font_medium.render("¡Imprimiendo tus fotos!", True, GREEN)
+        # Mostrar estado según disponibilidad de almacenamiento e impresora
+        if self.storage_available and self.printing_available():
+            text = self.font_medium.render("¡Imprimiendo tus fotos!", True, GREEN)
+            text_rect = text.get_rect(center=(SCREEN_WIDTH//2, 100))
             
-        text_rect = text.get_rect(center=(SCREEN_WIDTH//2, 100))
+            # Fondo semi-transparente para el texto
+            text_bg = pygame.Surface((text_rect.width + 40, text_rect.height + 20), pygame.SRCALPHA)
+            text_bg.fill((0, 0, 0, 180))
+            self.screen.blit(text_bg, (text_rect.x - 20, text_rect.y - 10))
+            self.screen.blit(text, text_rect)
         
-        # Fondo semi-transparente para el texto
-        text_bg = pygame.Surface((text_rect.width + 40, text_rect.height + 20), pygame.SRCALPHA)
-        text_bg.fill((0, 0, 0, 180))
-        self.screen.blit(text_bg, (text_rect.x - 20, text_rect.y - 10))
-        self.screen.blit(text, text_rect)
+        self.draw_credits()
         
         # Dibujar el marco por encima de todo
         self.draw_frame()
     
+    def draw_credits(self):
+        """Muestra los créditos pendientes en la parte inferior de la pantalla."""
+        if self.credits <= 0:
+            return
+        credits_text = self.font_small.render(f"CRÉDITOS: {self.credits}", True, YELLOW)
+        credits_rect = credits_text.get_rect(center=(SCREEN_WIDTH//2, SCREEN_HEIGHT - 100))
+        self.screen.blit(credits_text, credits_rect)
+    
     def update_initial_countdown(self):
         """Actualiza la cuenta regresiva inicial (5 segundos)."""
         if self.current_state == "initial_countdown":
@@ -837,55 +1116,84 @@ class PhotoboothGUI:
                         # Preparar para la siguiente foto
                         self.current_photo_countdown = BETWEEN_PHOTOS_TIME
     
+    def update_show_photos(self):
+        """Vuelve a la espera de moneda tras mostrar las fotos.
+        
+        En modo encadenado, si hay créditos esperando, la revisión se acorta
+        y la siguiente sesión empieza mientras la tira se imprime.
+        """
+        if self.current_state == "show_photos":
+            current_time = pygame.time.get_ticks()
+            if not hasattr(self, 'photo_display_start'):
+                self.photo_display_start = current_time
+            
+            display_time = SHOW_PHOTOS_TIME
+            if PIPELINE_SESSIONS and self.credits > 0:
+                display_time = min(display_time, PIPELINE_REVIEW_TIME)
+            
+            if current_time - self.photo_display_start >= display_time * 1000:
+                self.current_state = "waiting_coin"
+                delattr(self, 'photo_display_start')
+                # Limpiar variables para la siguiente sesión
+                self.photos_taken = 0
+                self.taken_photos = []
+                self.session_timestamp = None
+                self.save_dir = None
+                self.storage_available = False
+                set_session_active(False)
+    
+    def step(self):
+        """Una iteración del bucle principal: eventos, estado y dibujo."""
+        # Manejo de eventos
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    self.running = False
+                # Para pruebas: simular inserción de moneda con la tecla espacio
+                elif event.key == pygame.K_SPACE:
+                    self.add_credit()
+                # Elegir filtro de color con las flechas
+                elif event.key == pygame.K_RIGHT:
+                    self.select_next_filter(1)
+                elif event.key == pygame.K_LEFT:
+                    self.select_next_filter(-1)
+        
+        # Empezar una sesión si hay créditos
+        if self.current_state == "waiting_coin" and self.consume_credit():
+            self.start_photo_sequence()
+        
+        # Actualizar estado
+        if self.current_state == "initial_countdown":
+            self.update_initial_countdown()
+        elif self.current_state == "taking_photos":
+            self.update_photo_sequence()
+        elif self.current_state == "show_photos":
+            self.update_show_photos()
+        
+        # Dibujar pantalla según el estado actual
+        if self.current_state == "waiting_coin":
+            self.draw_waiting_screen()
+        elif self.current_state == "initial_countdown":
+            self.draw_initial_countdown_screen()
+        elif self.current_state == "taking_photos":
+            self.draw_taking_photos_screen()
+        elif self.current_state == "show_photos":
+            self.draw_show_photos_screen()
+        
+        pygame.display.flip()
+    
     def run(self):
         """Bucle principal del programa."""
         clock = pygame.time.Clock()
         
         try:
             while self.running:
-                # Manejo de eventos
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        self.running = False
-                    elif event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_ESCAPE:
-                            self.running = False
-                        # Para pruebas: simular inserción de moneda con la tecla espacio
-                        elif event.key == pygame.K_SPACE and self.current_state == "waiting_coin":
-                            self.start_photo_sequence()
-                
-                # Actualizar estado
-                if self.current_state == "initial_countdown":
-                    self.update_initial_countdown()
-                elif self.current_state == "taking_photos":
-                    self.update_photo_sequence()
-                elif self.current_state == "show_photos":
-                    # Mostrar las fotos durante X segundos
-                    current_time = pygame.time.get_ticks()
-                    if not hasattr(self, 'photo_display_start'):
-                        self.photo_display_start = current_time
-                    
-                    if current_time - self.photo_display_start >= 8000:  # 8 segundos para ver las 3 fotos
-                        self.current_state = "waiting_coin"
-                        delattr(self, 'photo_display_start')
-                        # Limpiar variables para la siguiente sesión
-                        self.photos_taken = 0
-                        self.taken_photos = []
-                        self.session_timestamp = None
-                        self.save_dir = None
-                        self.usb_available = False
-                
-                # Dibujar pantalla según el estado actual
-                if self.current_state == "waiting_coin":
-                    self.draw_waiting_screen()
-                elif self.current_state == "initial_countdown":
-                    self.draw_initial_countdown_screen()
-                elif self.current_state == "taking_photos":
-                    self.draw_taking_photos_screen()
-                elif self.current_state == "show_photos":
-                    self.draw_show_photos_screen()
-                
-                pygame.display.flip()
+                if self.profiler.armed:
+                    self.profiler.step(self.step, self.current_state)
+                else:
+                    self.step()
                 clock.tick(30)  # 30 FPS
                 
         except KeyboardInterrupt:
@@ -908,6 +1216,16 @@ class PhotoboothGUI:
                     print(f"Archivo temporal eliminado: {temp_file}")
         except Exception as e:
             print(f"Error al limpiar archivos temporales: {e}")
+        set_session_active(False)
+        self.journal.close()
+        if self.printer_pool is not None:
+            self.printer_pool.stop_monitor()
+        self.encoder.shutdown()
+        if self.frame_bus is not None:
+            print(f"Bus de frames: {self.frame_bus.summary()}")
+            self.frame_bus.close()
+        if self.staging is not None:
+            self.staging.stop()
         
         if self.camera is not None and self.camera.isOpened():
             self.camera.release()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Grupo de impresoras CUPS con reparto de carga y conmutación por error
+- Descubre todas las colas CUPS adecuadas (no solo la primera)
+- Envía cada tira a la impresora con menos trabajos en cola
+- Salta las impresoras con errores, sin papel o detenidas
+- Reenvía a otra impresora los trabajos atascados en una que falla
+- Prueba de rendimiento con impresoras simuladas: python3 printer_pool.py --simulate 2
+"""
+
+import time
+import threading
+from collections import Counter
+
+# Estados IPP de impresora
+PRINTER_STATE_IDLE = 3
+PRINTER_STATE_PROCESSING = 4
+PRINTER_STATE_STOPPED = 5
+
+# Motivos de estado que impiden imprimir aunque la cola acepte trabajos
+BLOCKING_REASONS = (
+    'media-empty', 'media-needed', 'media-jam', 'paused', 'offline',
+    'marker-supply-empty', 'door-open', 'cover-open', 'input-tray-missing',
+)
+
+
+def is_printer_ready(attrs):
+    """Indica si una impresora (atributos de getPrinters) puede recibir trabajos."""
+    if attrs.get('printer-state') == PRINTER_STATE_STOPPED:
+        return False
+    if not attrs.get('printer-is-accepting-jobs', True):
+        return False
+    for reason in attrs.get('printer-state-reasons', []):
+        if reason == 'none' or reason.endswith('-report') or reason.endswith('-warning'):
+            continue
+        if reason.endswith('-error') or reason.startswith(BLOCKING_REASONS):
+            return False
+    return True
+
+
+def printer_from_uri(uri):
+    """Extrae el nombre de la cola de un job-printer-uri (ipp://host/printers/NOMBRE)."""
+    return uri.rstrip('/').rsplit('/', 1)[-1] if uri else None
+
+
+class PrinterPool:
+    def __init__(self, conn, names=None, match=None, poll_interval=5, on_resubmit=None):
+        self.conn = conn
+        self.names = names          # Lista fija de colas, o None para todas
+        self.match = match          # Subcadena que debe contener el nombre (p. ej. 'DNP')
+        self.poll_interval = poll_interval
+        self.on_resubmit = on_resubmit  # Función (etiqueta, impresora, job_id) al reenviar un trabajo
+        self.lock = threading.Lock()  # pycups no es seguro entre hilos
+        self.printers = []
+        self.attrs = {}
+        self.jobs = {}              # job_id -> (impresora, fichero, título, opciones, etiqueta)
+        self.submitted = Counter()  # Trabajos enviados por impresora
+        self.failovers = 0
+        self.monitor_thread = None
+        self.running = False
+        self.refresh()
+
+    def refresh(self):
+        """Vuelve a leer las colas y su estado desde CUPS."""
+        with self.lock:
+            try:
+                attrs = self.conn.getPrinters()
+            except Exception as e:
+                print(f"Error al consultar impresoras en CUPS: {e}")
+                return
+        printers = []
+        for name in sorted(attrs):
+            if self.names is not None and name not in self.names:
+                continue
+            if self.match and self.match.lower() not in name.lower():
+                continue
+            printers.append(name)
+        if printers != self.printers:
+            print(f"Impresoras disponibles en el grupo: {', '.join(printers) or 'ninguna'}")
+        self.printers = printers
+        self.attrs = attrs
+
+    def ready_printers(self):
+        """Impresoras del grupo que ahora mismo pueden recibir trabajos."""
+        return [name for name in self.printers if is_printer_ready(self.attrs.get(name, {}))]
+
+    def queued_jobs(self):
+        """Número de trabajos sin terminar en cada impresora y sus job_id.
+
+        Si CUPS no responde el conjunto de trabajos es None: no se sabe
+        cuáles han terminado.
+        """
+        queued = Counter({name: 0 for name in self.printers})
+        with self.lock:
+            try:
+                jobs = self.conn.getJobs(which_jobs='not-completed',
+                                         requested_attributes=['job-id', 'job-printer-uri'])
+            except Exception as e:
+                print(f"Error al consultar trabajos en CUPS: {e}")
+                return queued, None
+        for job_id, attrs in jobs.items():
+            name = printer_from_uri(attrs.get('job-printer-uri'))
+            if name in queued:
+                queued[name] += 1
+        return queued, set(jobs)
+
+    def choose_printer(self, exclude=()):
+        """Elige la impresora lista con menos trabajos en cola (prefiere las inactivas)."""
+        self.refresh()
+        queued, _ = self.queued_jobs()
+        candidates = [name for name in self.ready_printers() if name not in exclude]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda name: (
+            queued[name],
+            self.attrs[name].get('printer-state') != PRINTER_STATE_IDLE,
+            self.submitted[name],
+        ))
+
+    def submit(self, filename, title, options, exclude=(), tag=None):
+        """Envía un fichero a la mejor impresora. Devuelve (impresora, job_id) o (None, None).
+
+        La etiqueta (p. ej. la sesión) se devuelve a on_resubmit si el trabajo se reenvía.
+        """
+        tried = set(exclude)
+        while True:
+            printer = self.choose_printer(exclude=tried)
+            if printer is None:
+                print("Ninguna impresora del grupo está disponible")
+                return None, None
+            try:
+                with self.lock:
+                    job_id = self.conn.printFile(printer, filename, title, options)
+            except Exception as e:
+                print(f"Error al enviar a {printer}: {e}. Probando otra impresora...")
+                tried.add(printer)
+                continue
+            self.jobs[job_id] = (printer, filename, title, options, tag)
+            self.submitted[printer] += 1
+            return printer, job_id
+
+    def check_failover(self):
+        """Reenvía los trabajos pendientes de impresoras que han dejado de estar listas."""
+        self.refresh()
+        ready = set(self.ready_printers())
+        # Copiar antes de consultar CUPS: un trabajo enviado entre medias no
+        # está en la copia y no se confunde con uno terminado
+        jobs = list(self.jobs.items())
+        _, pending = self.queued_jobs()
+        if pending is None:
+            return  # Sin respuesta de CUPS: no dar por terminado ningún trabajo
+
+        for job_id, (printer, filename, title, options, tag) in jobs:
+            if job_id not in pending:
+                # Terminado (o cancelado fuera del fotomatón)
+                del self.jobs[job_id]
+                continue
+            if printer in ready or not ready:
+                continue
+            print(f"Impresora {printer} no disponible. Moviendo trabajo {job_id}...")
+            new_printer, new_job_id = self.submit(filename, title, options, exclude={printer}, tag=tag)
+            if new_job_id is None:
+                continue
+            try:
+                with self.lock:
+                    self.conn.cancelJob(job_id)
+            except Exception as e:
+                print(f"Error al cancelar el trabajo {job_id} en {printer}: {e}")
+            del self.jobs[job_id]
+            self.failovers += 1
+            print(f"Trabajo {job_id} reenviado a {new_printer} como {new_job_id}")
+            if self.on_resubmit is not None:
+                self.on_resubmit(tag, new_printer, new_job_id)
+
+    def monitor_loop(self):
+        """Bucle de vigilancia de impresoras en un hilo separado."""
+        while self.running:
+            if self.jobs:
+                try:
+                    self.check_failover()
+                except Exception as e:
+                    print(f"Error al vigilar las impresoras: {e}")
+            time.sleep(self.poll_interval)
+
+    def start_monitor(self):
+        if self.monitor_thread is None:
+            self.running = True
+            self.monitor_thread = threading.Thread(target=self.monitor_loop)
+            self.monitor_thread.daemon = True
+            self.monitor_thread.start()
+
+    def stop_monitor(self):
+        self.running = False
+
+
+def simulate(printer_count, job_count, print_time, fail_after):
+    """Mide el rendimiento del grupo contra una instalación CUPS simulada."""
+    from fake_cups import FakeCupsConnection
+
+    names = [f"DNP_{i + 1}" for i in range(printer_count)]
+    conn = FakeCupsConnection(printers=names, print_time=print_time)
+    pool = PrinterPool(conn, poll_interval=print_time / 4)
+    pool.start_monitor()
+
+    started = time.time()
+    interval = print_time / printer_count  # Llegan trabajos al ritmo máximo teórico del grupo
+    for i in range(job_count):
+        if fail_after is not None and i == fail_after:
+            print(f"Simulando falta de papel en {names[0]}")
+            conn.set_printer_error(names[0], 'media-empty-error')
+        pool.submit(f"/tmp/tira_{i}.jpg", "Photobooth Strip", {})
+        time.sleep(interval)
+    while conn.pending_jobs():
+        time.sleep(print_time / 10)
+    pool.stop_monitor()
+
+    elapsed = time.time() - started
+    print(f"\n{job_count} tiras en {elapsed:.1f}s ({job_count / elapsed * 3600:.0f} tiras/hora)")
+    print(f"Trabajos impresos por impresora: {dict(conn.completed_by_printer())}")
+    print(f"Trabajos reenviados por fallo: {pool.failovers}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Grupo de impresoras del fotomatón")
+    parser.add_argument('--simulate', type=int, metavar='N', help="Simular N impresoras")
+    parser.add_argument('--jobs', type=int, default=60)
+    parser.add_argument('--print-time', type=float, default=0.5, help="Segundos por tira en la impresora simulada")
+    parser.add_argument('--fail-after', type=int, default=None, help="Dejar sin papel la primera impresora tras N trabajos")
+    args = parser.parse_args()
+
+    if args.simulate:
+        simulate(args.simulate, args.jobs, args.print_time, args.fail_after)
+    else:
+        import cups
+        pool = PrinterPool(cups.Connection())
+        queued, _ = pool.queued_jobs()
+        for name in pool.printers:
+            status = 'lista' if is_printer_ready(pool.attrs[name]) else 'NO DISPONIBLE'
+            print(f"{name:30s} {status:15s} {queued[name]} trabajos en cola  "
+                  f"{pool.attrs[name].get('printer-state-reasons')}")
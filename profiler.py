@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Perfilado bajo demanda del bucle principal del fotomatón
+- Se activa en caliente con SIGUSR1 (kill -USR1 <pid>) o desde settings.yml
+- Un cProfile por estado (waiting_coin, initial_countdown, taking_photos, show_photos)
+- Tiempos por frame y por estado, e instantáneas de memoria con tracemalloc
+- Durante una sesión nunca se detiene ni se escribe nada: los resultados se
+  guardan al volver a la pantalla de espera, desde un hilo aparte
+- Desactivado solo cuesta comprobar un atributo por frame
+"""
+
+import io
+import os
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+IDLE_STATE = "waiting_coin"
+TOP_ENTRIES = 30
+
+
+class PhaseProfiler:
+    def __init__(self, window=60, trace_allocations=True, output_dir=None):
+        self.window = window                        # Segundos de perfilado
+        self.trace_allocations = trace_allocations  # Usar tracemalloc
+        self.output_dir = output_dir                # Función que devuelve el directorio de salida
+        self.armed = False                          # Lo único que mira el bucle principal
+        self.started = None
+        self.profiles = {}
+        self.frames = {}
+        self.snapshot_start = None
+
+    def request(self, *args):
+        """Pide una ventana de perfilado. Se puede usar como manejador de señal."""
+        if not self.armed:
+            self.armed = True
+            print(f"Perfilado solicitado: {self.window} s")
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.profiles = {}
+        self.frames = {}
+        if self.trace_allocations:
+            tracemalloc.start(10)
+            self.snapshot_start = tracemalloc.take_snapshot()
+        print("Perfilado iniciado")
+
+    def step(self, func, state):
+        """Ejecuta una iteración del bucle principal perfilándola bajo su estado."""
+        if self.started is None:
+            self.start()
+        elif state == IDLE_STATE and time.perf_counter() - self.started >= self.window:
+            # Solo se termina fuera de una sesión para no provocar tirones
+            self.finish()
+            return func()
+
+        profile = self.profiles.get(state)
+        if profile is None:
+            profile = self.profiles[state] = cProfile.Profile()
+
+        frame_start = time.perf_counter()
+        profile.enable()
+        try:
+            return func()
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - frame_start
+            frames = self.frames.setdefault(state, [0, 0.0, 0.0])  # número, total, máximo
+            frames[0] += 1
+            frames[1] += elapsed
+            frames[2] = max(frames[2], elapsed)
+
+    def finish(self):
+        """Cierra la ventana y guarda los resultados en segundo plano."""
+        duration = time.perf_counter() - self.started
+        snapshot_end = None
+        if self.trace_allocations:
+            snapshot_end = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+        writer = threading.Thread(target=self.write_results,
+                                  args=(self.profiles, self.frames, self.snapshot_start, snapshot_end, duration))
+        writer.daemon = True
+        writer.start()
+
+        self.armed = False
+        self.started = None
+        self.profiles = {}
+        self.frames = {}
+        self.snapshot_start = None
+
+    def write_results(self, profiles, frames, snapshot_start, snapshot_end, duration):
+        try:
+            base_dir = (self.output_dir() if self.output_dir else None) or os.getcwd()
+            out_dir = os.path.join(base_dir, 'profiles', datetime.now().strftime("%Y%m%d_%H%M%S"))
+            os.makedirs(out_dir, exist_ok=True)
+
+            for state, profile in profiles.items():
+                # .prof se puede abrir con snakeviz o pstats
+                profile.dump_stats(os.path.join(out_dir, f"{state}.prof"))
+                text = io.StringIO()
+                pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(TOP_ENTRIES)
+                with open(os.path.join(out_dir, f"{state}.txt"), 'w') as f:
+                    f.write(text.getvalue())
+
+            with open(os.path.join(out_dir, 'frames.txt'), 'w') as f:
+                f.write(f"Ventana de perfilado: {duration:.1f} s\n")
+                f.write(f"{'estado':20s} {'frames':>8s} {'media ms':>10s} {'máx ms':>10s}\n")
+                for state, (count, total, worst) in sorted(frames.items()):
+                    f.write(f"{state:20s} {count:8d} {total / count * 1000:10.2f} {worst * 1000:10.2f}\n")
+
+            if snapshot_start is not None and snapshot_end is not None:
+                with open(os.path.join(out_dir, 'tracemalloc.txt'), 'w') as f:
+                    f.write("Mayores crecimientos de memoria durante la ventana:\n")
+                    for stat in snapshot_end.compare_to(snapshot_start, 'lineno')[:TOP_ENTRIES]:
+                        f.write(f"{stat}\n")
+                    f.write("\nMayores consumidores al final de la ventana:\n")
+                    for stat in snapshot_end.statistics('lineno')[:TOP_ENTRIES]:
+                        f.write(f"{stat}\n")
+
+            print(f"Perfilado guardado en {out_dir}")
+        except Exception as e:
+            print(f"Error al guardar el perfilado: {e}")
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Diario de sesiones del fotomatón
+- Registro de solo-añadir (una línea JSON por evento)
+- fsync en los puntos clave: moneda, foto guardada, tira creada, trabajo enviado
+- Al arrancar se relee para recuperar la sesión que quedó a medias
+- Al superar el tamaño máximo se compacta: el diario nuevo solo guarda los
+  créditos y las sesiones abiertas, así que la recuperación sigue siendo
+  instantánea aunque las sesiones se encadenen sin pausa
+"""
+
+import os
+import json
+import time
+import threading
+
+# Tipos de evento
+EVENT_COIN = 'coin'
+EVENT_PHOTO = 'photo'
+EVENT_STRIP = 'strip'
+EVENT_JOB = 'job'
+EVENT_END = 'end'
+EVENT_CREDITS = 'credits'
+
+
+class SessionJournal:
+    def __init__(self, path, max_bytes=64 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()  # El hilo de impresión también escribe
+        self.file = None
+        # Todo lo que sigue solo se toca con self.lock tomado
+        self.last_credits = 0    # Se copia al diario compactado para no perder créditos
+        self.open_sessions = {}  # sesión -> líneas del diario, para copiarlas al compactar
+
+    def _open(self):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+            # Cerrar una línea que quedó a medias para no corromper la siguiente
+            if self.file.tell() > 0:
+                with open(self.path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        self.file.write('\n')
+        return self.file
+
+    def _append(self, event, session, sync=True, **data):
+        """Añade un evento al diario. Los errores no deben parar el fotomatón."""
+        record = {'t': round(time.time(), 3), 'e': event, 's': session}
+        record.update(data)
+        line = json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n'
+        with self.lock:
+            if event == EVENT_COIN:
+                self.open_sessions[session] = [line]
+            elif event == EVENT_END:
+                self.open_sessions.pop(session, None)
+            elif event == EVENT_CREDITS:
+                self.last_credits = data['n']
+            elif session in self.open_sessions:
+                self.open_sessions[session].append(line)
+            try:
+                f = self._open()
+                f.write(line)
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+                if f.tell() >= self.max_bytes:
+                    self._compact()
+            except OSError as e:
+                print(f"Error al escribir en el diario de sesiones: {e}")
+
+    def coin(self, session, save_dir):
+        """Moneda aceptada: empieza una sesión."""
+        self._append(EVENT_COIN, session, save_dir=save_dir)
+
+    def photo(self, session, index, path):
+        """Foto guardada en disco."""
+        self._append(EVENT_PHOTO, session, n=index, path=path)
+
+    def strip(self, session, path):
+        """Tira para impresión creada."""
+        self._append(EVENT_STRIP, session, path=path)
+
+    def job(self, session, printer, job_id):
+        """Trabajo enviado a CUPS."""
+        self._append(EVENT_JOB, session, printer=printer, job=job_id)
+
+    def credits(self, count):
+        """Créditos (monedas) pendientes de usar.
+
+        Quien llama debe escribirlos con su propio cerrojo tomado para que
+        los registros queden en el mismo orden que los cambios.
+        """
+        self._append(EVENT_CREDITS, None, n=count)
+
+    def end(self, session, status):
+        """Sesión cerrada."""
+        self._append(EVENT_END, session, sync=False, status=status)
+
+    def _compact(self):
+        """Sustituye el diario por uno con los créditos y las sesiones abiertas.
+
+        Se llama con self.lock tomado. El diario anterior queda en .1 (enlace
+        duro) y el nuevo entra con un rename atómico: en todo momento
+        self.path contiene todo lo necesario para recuperar.
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if self.last_credits:
+                record = {'t': round(time.time(), 3), 'e': EVENT_CREDITS, 's': None, 'n': self.last_credits}
+                f.write(json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n')
+            for lines in self.open_sessions.values():
+                f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.file.close()
+        self.file = None
+        try:
+            if os.path.exists(self.path + '.1'):
+                os.remove(self.path + '.1')
+            os.link(self.path, self.path + '.1')
+        except OSError:
+            pass  # La copia .1 es solo para consulta
+        os.replace(tmp_path, self.path)
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def recover(self):
+        """Devuelve (sesiones sin cerrar, créditos pendientes).
+
+        Las sesiones van en orden de llegada (puede haber varias abiertas
+        en modo encadenado) y cada una es un diccionario con 'session',
+        'save_dir', 'photos' (índice -> ruta), 'strip' y 'job'.
+        """
+        started = time.perf_counter()
+        pending = {}
+        lines = {}
+        credits = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Línea incompleta por un corte a mitad de escritura
+                        continue
+                    event = record.get('e')
+                    session = record.get('s')
+                    if event == EVENT_CREDITS:
+                        credits = record.get('n', 0)
+                    elif event == EVENT_COIN:
+                        pending[session] = {'session': session, 'save_dir': record.get('save_dir'),
+                                            'photos': {}, 'strip': None, 'job': None}
+                        lines[session] = [line if line.endswith('\n') else line + '\n']
+                        continue
+                    elif session not in pending:
+                        continue
+                    elif event == EVENT_PHOTO:
+                        pending[session]['photos'][record['n']] = record['path']
+                    elif event == EVENT_STRIP:
+                        pending[session]['strip'] = record['path']
+                    elif event == EVENT_JOB:
+                        pending[session]['job'] = record['job']
+                    elif event == EVENT_END:
+                        del pending[session]
+                        del lines[session]
+                        continue
+                    if session in lines:
+                        lines[session].append(line if line.endswith('\n') else line + '\n')
+        except FileNotFoundError:
+            return [], 0
+        except OSError as e:
+            print(f"Error al leer el diario de sesiones: {e}")
+            return [], 0
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"Diario de sesiones leído en {elapsed_ms:.1f} ms")
+        with self.lock:
+            self.last_credits = credits
+            self.open_sessions = lines
+        return list(pending.values()), credits
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Medición del retraso del disparo (shutter latency) del fotomatón
+- Pone la pantalla en blanco como hace update_photo_sequence() y busca en el
+  flujo de la cámara el primer frame que ya ve el flash
+- Registra la hora de cada flip de pantalla, la hora de lectura de cada frame
+  y la marca de tiempo del driver (CAP_PROP_POS_MSEC en V4L2)
+- Prueba distintas profundidades de buffer y vaciado de la cola antes de leer,
+  por cámara y formato de píxel
+- Comprueba si la captura tal como la hace take_photo() (flash, espera de
+  100 ms, lectura) obtiene un frame con el flash o uno antiguo
+- Lee al ritmo del bucle principal (--loop-fps), no tan rápido como entrega
+  la cámara: así la cola de V4L2 se llena como en el fotomatón
+
+La cámara tiene que apuntar a la pantalla (o usar --simulate).
+
+Uso: python3 shutter_latency.py --formats MJPG YUYV --buffer-sizes 1 4 --drain 0 3
+"""
+
+import time
+import json
+import random
+import argparse
+import statistics
+from collections import deque
+import cv2
+import numpy as np
+
+
+# ------------------------------------------------------
+# Pantalla y cámara
+# ------------------------------------------------------
+class RealScreen:
+    """Pantalla real con pygame."""
+    def __init__(self, width, height, fullscreen):
+        import pygame
+        self.pygame = pygame
+        pygame.init()
+        flags = pygame.FULLSCREEN if fullscreen else 0
+        self.surface = pygame.display.set_mode((width, height), flags)
+        pygame.mouse.set_visible(False)
+
+    def show(self, color):
+        """Pinta la pantalla y devuelve la hora monotónica (s) justo después del flip."""
+        self.surface.fill(color)
+        self.pygame.display.flip()
+        self.pygame.event.pump()
+        return time.monotonic()
+
+    def close(self):
+        self.pygame.quit()
+
+
+class SimulatedRig:
+    """Pantalla y cámara simuladas con una cola de buffers como la de V4L2.
+
+    La cámara captura a fps fijos; si la aplicación no lee, el driver llena
+    buffer_size buffers con los frames más antiguos y descarta los nuevos.
+    """
+    def __init__(self, fps=30, buffer_size=4, display_lag_ms=20, exposure_ms=15):
+        self.period = 1.0 / fps
+        self.buffer_size = buffer_size
+        self.display_lag = display_lag_ms / 1000.0
+        self.exposure = exposure_ms / 1000.0
+        self.start = time.monotonic()
+        # Fase aleatoria: la cámara no está sincronizada con el bucle que la lee
+        self.next_capture = self.start + random.uniform(0, self.period)
+        self.queue = deque()
+        self.screen_history = [(0.0, 0)]  # (hora en que se ve, brillo)
+        self.last_timestamp = 0.0
+
+    # Pantalla
+    def show(self, color):
+        now = time.monotonic()
+        self.screen_history.append((now + self.display_lag, int(sum(color) / 3)))
+        return now
+
+    def close(self):
+        pass
+
+    # Cámara (interfaz de cv2.VideoCapture)
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_BUFFERSIZE:
+            self.buffer_size = max(1, int(value))
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.last_timestamp * 1000
+        return 0
+
+    def brightness_at(self, t):
+        value = 0
+        for since, brightness in self.screen_history:
+            if since <= t:
+                value = brightness
+        return value
+
+    def _fill(self):
+        now = time.monotonic()
+        while self.next_capture <= now:
+            if len(self.queue) < self.buffer_size:
+                # El frame refleja la pantalla al final de la exposición
+                self.queue.append(self.next_capture)
+            self.next_capture += self.period
+
+    def grab(self):
+        self._fill()
+        if not self.queue:
+            time.sleep(max(0.0, self.next_capture - time.monotonic()))
+            self._fill()
+        self.last_timestamp = self.queue.popleft()
+        return True
+
+    def retrieve(self):
+        brightness = self.brightness_at(self.last_timestamp - self.exposure / 2)
+        return True, np.full((48, 64, 3), brightness, np.uint8)
+
+    def read(self):
+        self.grab()
+        return self.retrieve()
+
+    def release(self):
+        pass
+
+
+def open_camera(index, fourcc, buffer_size, width, height):
+    camera = cv2.VideoCapture(index)
+    if not camera.isOpened():
+        raise RuntimeError(f"No se pudo abrir la cámara {index}")
+    if fourcc:
+        camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+    if buffer_size:
+        camera.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+    camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    return camera
+
+
+# ------------------------------------------------------
+# Medición
+# ------------------------------------------------------
+class LoopPacer:
+    """Ritmo del bucle principal: una lectura por vuelta, como clock.tick() en run()."""
+    def __init__(self, fps):
+        self.period = 1.0 / fps
+        self.next = time.monotonic()
+
+    def wait(self):
+        self.next += self.period
+        delay = self.next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next = time.monotonic()  # Vuelta lenta: no intentar recuperar
+
+
+def frame_brightness(frame):
+    small = cv2.resize(frame, (32, 24), interpolation=cv2.INTER_AREA)
+    return float(small.mean())
+
+
+def read_timed(camera):
+    """Lee un frame y devuelve (brillo, hora de lectura, marca de tiempo del driver en s o None)."""
+    ok, frame = camera.read()
+    read_time = time.monotonic()
+    if not ok:
+        raise RuntimeError("Error al leer de la cámara")
+    driver_ms = camera.get(cv2.CAP_PROP_POS_MSEC)
+    # V4L2 usa CLOCK_MONOTONIC; otras fuentes no sirven para comparar con el flip
+    driver_time = driver_ms / 1000.0 if driver_ms and abs(driver_ms / 1000.0 - read_time) < 10 else None
+    return frame_brightness(frame), read_time, driver_time
+
+
+def settle(screen, camera, seconds, loop_fps):
+    """Pantalla en negro leyendo frames al ritmo de la vista previa. Devuelve el brillo de referencia."""
+    screen.show((0, 0, 0))
+    pacer = LoopPacer(loop_fps)
+    deadline = time.monotonic() + seconds
+    values = []
+    while time.monotonic() < deadline:
+        values.append(read_timed(camera)[0])
+        pacer.wait()
+    return statistics.median(values[-10:]) if values else 0.0
+
+
+def measure_latency(screen, camera, baseline, threshold, loop_fps, timeout=2.0):
+    """Flash y una lectura por vuelta del bucle hasta ver el primer frame con el flash."""
+    flip = screen.show((255, 255, 255))
+    pacer = LoopPacer(loop_fps)
+    stale = 0
+    while time.monotonic() - flip < timeout:
+        brightness, read_time, driver_time = read_timed(camera)
+        if brightness > baseline + threshold:
+            return {
+                'read_latency_ms': (read_time - flip) * 1000,
+                'driver_latency_ms': (driver_time - flip) * 1000 if driver_time else None,
+                'stale_frames': stale,
+            }
+        stale += 1
+        pacer.wait()
+    return None
+
+
+def measure_booth_capture(screen, camera, baseline, threshold, capture_delay_ms, drain):
+    """Reproduce take_photo(): flash, espera, vaciado opcional y una lectura."""
+    screen.show((255, 255, 255))
+    time.sleep(capture_delay_ms / 1000.0)
+    for _ in range(drain):
+        camera.grab()
+    brightness, _, _ = read_timed(camera)
+    return brightness > baseline + threshold
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def run_config(args, camera_index, fourcc, buffer_size, drain):
+    if args.simulate:
+        rig = SimulatedRig(fps=args.sim_fps, buffer_size=buffer_size or 4)
+        screen, camera = rig, rig
+    else:
+        camera = open_camera(camera_index, fourcc, buffer_size, args.width, args.height)
+        screen = args.screen
+
+    latencies, driver_latencies, stale, hits, misses = [], [], [], 0, 0
+    for _ in range(args.trials):
+        baseline = settle(screen, camera, args.settle, args.loop_fps)
+        result = measure_latency(screen, camera, baseline, args.threshold, args.loop_fps)
+        if result is None:
+            misses += 1
+        else:
+            latencies.append(result['read_latency_ms'])
+            stale.append(result['stale_frames'])
+            if result['driver_latency_ms'] is not None:
+                driver_latencies.append(result['driver_latency_ms'])
+
+        baseline = settle(screen, camera, args.settle, args.loop_fps)
+        if measure_booth_capture(screen, camera, baseline, args.threshold, args.capture_delay, drain):
+            hits += 1
+
+    if not args.simulate:
+        camera.release()
+
+    summary = {
+        'camera': camera_index,
+        'format': fourcc or 'predeterminado',
+        'buffer_size': buffer_size or 'predeterminado',
+        'drain': drain,
+        'trials': args.trials,
+        'not_detected': misses,
+        'latency_p50_ms': percentile(latencies, 50),
+        'latency_p90_ms': percentile(latencies, 90),
+        'latency_max_ms': max(latencies) if latencies else None,
+        'driver_latency_p50_ms': percentile(driver_latencies, 50),
+        'stale_frames_mean': statistics.mean(stale) if stale else None,
+        'booth_capture_with_flash': hits / args.trials if args.trials else 0,
+    }
+    return summary
+
+
+def fmt(value):
+    return f"{value:7.0f}" if isinstance(value, (int, float)) else f"{'-':>7s}"
+
+
+def print_table(results):
+    print(f"\n{'cám':>3s} {'formato':>14s} {'buffers':>14s} {'vaciado':>7s} "
+          f"{'p50 ms':>7s} {'p90 ms':>7s} {'máx ms':>7s} {'driver':>7s} {'viejos':>7s} {'foto OK':>7s}")
+    for r in results:
+        stale = f"{r['stale_frames_mean']:7.1f}" if r['stale_frames_mean'] is not None else f"{'-':>7s}"
+        print(f"{r['camera']:>3} {r['format']:>14s} {str(r['buffer_size']):>14s} {r['drain']:>7d} "
+              f"{fmt(r['latency_p50_ms'])} {fmt(r['latency_p90_ms'])} {fmt(r['latency_max_ms'])} "
+              f"{fmt(r['driver_latency_p50_ms'])} {stale} {r['booth_capture_with_flash'] * 100:6.0f}%")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Retraso del disparo del fotomatón")
+    parser.add_argument('--cameras', type=int, nargs='+', default=[0], help="Índices de cámara")
+    parser.add_argument('--formats', nargs='+', default=[None], help="Formatos de píxel (MJPG, YUYV...)")
+    parser.add_argument('--buffer-sizes', type=int, nargs='+', default=[None], help="Valores de CAP_PROP_BUFFERSIZE")
+    parser.add_argument('--drain', type=int, nargs='+', default=[0], help="Frames a descartar antes de la captura")
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--threshold', type=float, default=40, help="Subida de brillo que indica el flash")
+    parser.add_argument('--settle', type=float, default=0.5, help="Segundos en negro entre pruebas")
+    parser.add_argument('--capture-delay', type=int, default=100, help="Espera tras el flash en take_photo() (ms)")
+    parser.add_argument('--loop-fps', type=float, default=25,
+                        help="Vueltas por segundo del bucle principal (ver frames.txt del perfilado)")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--windowed', action='store_true', help="No usar pantalla completa")
+    parser.add_argument('--simulate', action='store_true', help="Pantalla y cámara simuladas")
+    parser.add_argument('--sim-fps', type=int, default=30)
+    parser.add_argument('--json', help="Guardar los resultados en un fichero JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.screen = None if args.simulate else RealScreen(args.width, args.height, not args.windowed)
+
+    results = []
+    try:
+        for camera_index in args.cameras:
+            for fourcc in args.formats:
+                for buffer_size in args.buffer_sizes:
+                    for drain in args.drain:
+                        print(f"Midiendo cámara {camera_index}, formato {fourcc}, "
+                              f"buffers {buffer_size}, vaciado {drain}...")
+                        results.append(run_config(args, camera_index, fourcc, buffer_size, drain))
+    finally:
+        if args.screen is not None:
+            args.screen.close()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+        print(f"Resultados guardados en {args.json}")
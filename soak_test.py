@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prueba de resistencia (soak test) del fotomatón
+- Ejecuta miles de sesiones seguidas sin pantalla ni hardware
+- Monedas, cámara e impresora simuladas; reloj virtual más rápido que el real
+- Informa de sesiones por hora, crecimiento de memoria (RSS), descriptores
+  de fichero, hilos y deriva de la latencia por sesión
+
+Uso: python3 soak_test.py --sessions 2000 [--report-every 100] [--json salida.json]
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import argparse
+import tempfile
+import threading
+
+# Sin pantalla ni audio: SDL usa los drivers nulos
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import cv2
+import numpy as np
+import pygame
+
+from fake_cups import FakeCupsConnection
+
+
+# ------------------------------------------------------
+# Hardware simulado
+# ------------------------------------------------------
+class FakeGPIO(types.ModuleType):
+    """Sustituye a RPi.GPIO. El pin de monedas se controla desde el harness."""
+    BCM = 'BCM'
+    IN = 'IN'
+    OUT = 'OUT'
+    HIGH = 1
+    LOW = 0
+    PUD_DOWN = 'PUD_DOWN'
+
+    def __init__(self):
+        super().__init__('RPi.GPIO')
+        self.pins = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None):
+        self.pins[pin] = self.LOW
+
+    def input(self, pin):
+        return self.pins.get(pin, self.LOW)
+
+    def output(self, pin, value):
+        self.pins[pin] = value
+
+    def cleanup(self):
+        self.pins.clear()
+
+
+class FakeCamera:
+    """Sustituye a cv2.VideoCapture con frames sintéticos."""
+    def __init__(self, index=0):
+        self.width = 1280
+        self.height = 720
+        self.frame = None
+        self.count = 0
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            self.width = int(value)
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            self.height = int(value)
+        self.frame = None
+
+    def read(self):
+        if self.frame is None:
+            # Degradado fijo para que el JPEG tenga un tamaño realista
+            x = np.linspace(0, 255, self.width, dtype=np.uint8)
+            y = np.linspace(0, 255, self.height, dtype=np.uint8)
+            self.frame = np.dstack([np.tile(x, (self.height, 1)),
+                                    np.tile(y[:, None], (1, self.width)),
+                                    np.full((self.height, self.width), 128, np.uint8)])
+        self.count += 1
+        frame = self.frame.copy()
+        frame[:8, :8] = self.count % 256  # Cada frame distinto
+        return True, frame
+
+    def grab(self):
+        self.count += 1
+        return True
+
+    def release(self):
+        pass
+
+
+class VirtualClock:
+    """Reloj virtual para pygame.time: delay() avanza el reloj sin dormir."""
+    def __init__(self):
+        self.ticks = 0
+
+    def get_ticks(self):
+        return self.ticks
+
+    def delay(self, ms):
+        self.ticks += ms
+        return ms
+
+    def advance(self, ms):
+        self.ticks += ms
+
+
+def install_fakes(spool_delay, printers):
+    """Registra GPIO y CUPS simulados antes de importar photomaton."""
+    gpio = FakeGPIO()
+    rpi = types.ModuleType('RPi')
+    rpi.GPIO = gpio
+    sys.modules['RPi'] = rpi
+    sys.modules['RPi.GPIO'] = gpio
+
+    cups = types.ModuleType('cups')
+    cups.Connection = lambda: FakeCupsConnection(printers=printers, spool_delay=spool_delay)
+    sys.modules['cups'] = cups
+    return gpio
+
+
+# ------------------------------------------------------
+# Métricas del proceso
+# ------------------------------------------------------
+def rss_kb():
+    """Memoria residente actual en KB (Linux)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def open_fds():
+    """Número de descriptores de fichero abiertos (Linux)."""
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return -1
+
+
+def background_threads():
+    """Hilos vivos sin contar el pool del codificador.
+
+    El pool arranca sus hilos al primer encargo y no los cierra nunca: su
+    tamaño está acotado por ENCODE_WORKERS, así que no es una fuga.
+    """
+    return sum(1 for thread in threading.enumerate() if not thread.name.startswith('encoder'))
+
+
+def mean(values):
+    return sum(values) / len(values) if values else 0.0
+
+
+# ------------------------------------------------------
+# Harness
+# ------------------------------------------------------
+class SoakTest:
+    def __init__(self, args):
+        self.args = args
+        printers = [f"Simulada_{i + 1}" for i in range(args.printers)]
+        self.gpio = install_fakes(args.spool_delay, printers)
+
+        import photomaton
+        self.photomaton = photomaton
+
+        # Todo lo que escribe el fotomatón va a un directorio temporal
+        self.work_dir = tempfile.mkdtemp(prefix='photobooth_soak_')
+        self.save_dir = os.path.join(self.work_dir, 'photobooth_images')
+        os.makedirs(self.save_dir)
+        photomaton.get_save_directory = lambda: self.save_dir
+        photomaton.JOURNAL_PATH = os.path.join(self.work_dir, 'session_journal.log')
+        photomaton.SESSION_ACTIVE_FLAG = os.path.join(self.work_dir, 'sesion_activa')
+        photomaton.STAGING_DIR = os.path.join(self.work_dir, 'staging')
+        photomaton.STAGING_MAX_BYTES = 64 * 1024 * 1024  # Obliga a borrar sesiones ya volcadas
+        photomaton.FULLSCREEN = False
+        photomaton.PIPELINE_SESSIONS = args.pipelined
+        photomaton.cv2.VideoCapture = FakeCamera
+
+        self.clock = VirtualClock()
+        pygame.time.get_ticks = self.clock.get_ticks
+        pygame.time.delay = self.clock.delay
+
+        self.booth = photomaton.PhotoboothGUI()
+        self.latencies = []
+        self.samples = []
+
+    def insert_coin(self):
+        """Simula un pulso de moneda en el pin GPIO y espera a que el hilo lo cuente."""
+        coin_pin = self.photomaton.COIN_PIN
+        coins = self.booth.coins_inserted
+        self.gpio.output(coin_pin, self.gpio.HIGH)
+        deadline = time.time() + 5
+        while self.booth.coins_inserted == coins:
+            if time.time() > deadline:
+                raise RuntimeError("El hilo de monedas no detectó la moneda")
+            time.sleep(0.005)
+        self.gpio.output(coin_pin, self.gpio.LOW)
+        # Esperar a que el hilo vea el pin bajo para que el siguiente pulso sea un flanco nuevo
+        time.sleep(0.25)
+
+    def run_session(self):
+        """Ejecuta una sesión completa y devuelve su duración real en segundos.
+
+        En modo encadenado el siguiente cliente mete su moneda durante la
+        sesión, así que la sesión termina cuando empieza la siguiente.
+        """
+        started = time.perf_counter()
+        if self.booth.credits == 0:
+            self.insert_coin()
+        session = self.booth.sessions_started
+        next_coin_inserted = False
+        steps = 0
+        while True:
+            self.clock.advance(self.args.step_ms)
+            self.booth.step()
+            steps += 1
+            if self.booth.sessions_started > session + 1:
+                break
+            if self.booth.sessions_started == session + 1 and self.booth.current_state == "waiting_coin":
+                break
+            if (self.args.pipelined and not next_coin_inserted
+                    and self.booth.current_state == "taking_photos"):
+                self.insert_coin()
+                next_coin_inserted = True
+            if steps > 10000:
+                raise RuntimeError(f"Sesión atascada en el estado {self.booth.current_state}")
+        return time.perf_counter() - started
+
+    def sample(self, session):
+        sample = {
+            'session': session,
+            'elapsed': round(time.perf_counter() - self.started, 3),
+            'rss_kb': rss_kb(),
+            'fds': open_fds(),
+            'threads': background_threads(),
+            'encoder_threads': threading.active_count() - background_threads(),
+            'latency_ms': round(mean(self.latencies[-self.args.report_every:]) * 1000, 1),
+        }
+        self.samples.append(sample)
+        print(f"[{session:6d}] {sample['elapsed']:8.1f}s  RSS {sample['rss_kb'] / 1024:7.1f} MB  "
+              f"fds {sample['fds']:4d}  hilos {sample['threads']:3d}  "
+              f"latencia media {sample['latency_ms']:7.1f} ms")
+
+    def wait_background_work(self, timeout=10):
+        """Espera a que terminen los hilos de impresión lanzados por las sesiones."""
+        deadline = time.time() + timeout
+        while background_threads() > self.baseline_threads and time.time() < deadline:
+            time.sleep(0.01)
+
+    def cleanup_files(self):
+        """Borra las fotos generadas para no llenar el disco durante la prueba."""
+        # No borrar fotos que una tira en curso todavía tiene que leer
+        self.wait_background_work()
+        for name in os.listdir(self.save_dir):
+            try:
+                os.remove(os.path.join(self.save_dir, name))
+            except OSError:
+                pass
+
+    def run(self):
+        self.started = time.perf_counter()
+        self.baseline_threads = background_threads()
+        self.sample(0)
+        try:
+            for session in range(1, self.args.sessions + 1):
+                self.latencies.append(self.run_session())
+                if session % self.args.report_every == 0:
+                    # Muestrear antes de esperar a los hilos para ver los que se acumulan
+                    self.sample(session)
+                    if not self.args.keep_files:
+                        self.cleanup_files()
+        finally:
+            self.booth.running = False
+            self.booth.cleanup()
+        return self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        sessions = len(self.latencies)
+        window = max(1, min(self.args.report_every, sessions // 4 or 1))
+        first, last = self.samples[0], self.samples[-1]
+        head = mean(self.latencies[:window])
+        tail = mean(self.latencies[-window:])
+        summary = {
+            'sessions': sessions,
+            'elapsed_s': round(elapsed, 1),
+            'sessions_per_hour': round(sessions / elapsed * 3600, 1) if elapsed else 0,
+            # Sesiones por hora de fotomatón real (reloj virtual), la cifra que importa en un evento
+            'booth_sessions_per_hour': round(sessions / self.clock.ticks * 3600 * 1000, 1) if self.clock.ticks else 0,
+            'rss_growth_kb': last['rss_kb'] - first['rss_kb'],
+            'fd_growth': last['fds'] - first['fds'],
+            'thread_growth': last['threads'] - first['threads'],
+            'latency_first_ms': round(head * 1000, 1),
+            'latency_last_ms': round(tail * 1000, 1),
+            'latency_drift_pct': round((tail - head) / head * 100, 1) if head else 0,
+            'print_jobs': len(self.booth.conn.jobs),
+            'encoding': self.booth.encoder.summary(),
+            'staging': self.booth.staging.report() if self.booth.staging else None,
+            'samples': self.samples,
+        }
+        print("\n--- Resumen de la prueba de resistencia ---")
+        print(f"Sesiones: {sessions} en {summary['elapsed_s']} s "
+              f"({summary['sessions_per_hour']} sesiones/hora)")
+        print(f"Ritmo en tiempo de fotomatón: {summary['booth_sessions_per_hour']} sesiones/hora"
+              f"{' (modo encadenado)' if self.args.pipelined else ''}")
+        print(f"Crecimiento de RSS: {summary['rss_growth_kb'] / 1024:.1f} MB")
+        print(f"Crecimiento de descriptores: {summary['fd_growth']}")
+        print(f"Crecimiento de hilos: {summary['thread_growth']} "
+              f"(más {last['encoder_threads']} del pool del codificador)")
+        print(f"Latencia por sesión: {summary['latency_first_ms']} ms -> {summary['latency_last_ms']} ms "
+              f"({summary['latency_drift_pct']:+.1f}%)")
+        print(f"Trabajos de impresión enviados: {summary['print_jobs']}")
+        if summary['staging']:
+            staging = summary['staging']
+            print(f"Volcado al pendrive: {staging['flushed_sessions']} sesiones, "
+                  f"{staging.get('avg_mb_s', 0)} MB/s de media, pendientes {staging['backlog_sessions']} "
+                  f"sesiones ({staging['backlog_bytes'] / (1024 * 1024):.1f} MB)")
+        for profile, stats in summary['encoding'].items():
+            if stats['count']:
+                print(f"Codificación '{profile}': {stats['count']} salidas, {stats['avg_kb']} KB, "
+                      f"{stats['avg_encode_ms']} ms codificando, {stats['avg_write_ms']} ms escribiendo")
+
+        if self.args.json:
+            with open(self.args.json, 'w') as f:
+                json.dump(summary, f, indent=1)
+            print(f"Resultados guardados en {self.args.json}")
+        if not self.args.keep_files:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Prueba de resistencia del fotomatón")
+    parser.add_argument('--sessions', type=int, default=1000, help="Número de sesiones a simular")
+    parser.add_argument('--report-every', type=int, default=100, help="Sesiones entre muestras")
+    parser.add_argument('--step-ms', type=int, default=250, help="Milisegundos virtuales por iteración")
+    parser.add_argument('--spool-delay', type=float, default=0.0, help="Segundos que tarda la impresora simulada")
+    parser.add_argument('--printers', type=int, default=1, help="Número de impresoras simuladas")
+    parser.add_argument('--pipelined', action='store_true',
+                        help="Modo encadenado: cada cliente mete su moneda durante la sesión anterior")
+    parser.add_argument('--keep-files', action='store_true', help="No borrar las fotos generadas")
+    parser.add_argument('--json', help="Guardar el resumen en un fichero JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    SoakTest(parse_args()).run()
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+Área de preparación local del fotomatón (escritura diferida al pendrive)
+- Todas las fotos y tiras se escriben primero en almacenamiento local
+  (tarjeta SD o tmpfs), así que imprimir nunca depende del pendrive
+- Un hilo vuelca las sesiones terminadas al pendrive en lotes secuenciales,
+  con fsync y verificación, y continúa solo si se quita y se vuelve a poner
+- Las sesiones ya volcadas se borran cuando se supera el tamaño máximo
+- Sin pendrive no se borra nada: se avisa al encargado de cuánto hay en local
+- Si no cabe otra sesión (tamaño máximo o espacio libre del sistema de
+  ficheros), la sesión solo se usa para imprimir y se borra después
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import threading
+
+COMPLETE_MARKER = '.complete'  # La sesión no va a escribir más ficheros
+FLUSHED_MARKER = '.flushed'    # La sesión ya está verificada en el pendrive
+TRANSIENT_MARKER = '.transient'  # Sesión sin sitio en el área local: se borra tras imprimir
+COPY_BUFFER = 1024 * 1024      # Bloques grandes: el pendrive va mucho mejor con escrituras secuenciales
+WARN_INTERVAL = 300            # Segundos entre avisos repetidos por consola
+MIN_FREE_BYTES = 64 * 1024 * 1024  # Espacio libre que se deja siempre (en tmpfs es RAM)
+
+
+def dir_size(path):
+    total = 0
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return 0  # El hilo de volcado la acaba de borrar
+    for name in names:
+        try:
+            total += os.path.getsize(os.path.join(path, name))
+        except OSError:
+            pass
+    return total
+
+
+def fsync_dir(path):
+    """Asegura que las entradas del directorio (renombrados) llegan al disco."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def file_digest(path, drop_cache=False):
+    """SHA-256 de un fichero. Con drop_cache se relee del dispositivo y no de la caché."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if drop_cache and hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        for block in iter(lambda: f.read(COPY_BUFFER), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_file_synced(src, dst):
+    """Copia src a dst por bloques grandes y hace fsync. Devuelve el SHA-256 del origen."""
+    digest = hashlib.sha256()
+    tmp = dst + '.part'
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        for block in iter(lambda: fin.read(COPY_BUFFER), b''):
+            digest.update(block)
+            fout.write(block)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp, dst)
+    return digest.hexdigest()
+
+
+class StagingArea:
+    def __init__(self, root, max_bytes, target_dir, is_busy=None,
+                 flush_interval=10, flush_backlog_bytes=None, session_bytes=16 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.session_bytes = session_bytes  # Lo que se reserva para una sesión (3 fotos y la tira)
+        self.target_dir = target_dir        # Función que devuelve el directorio del pendrive o None
+        self.is_busy = is_busy              # Función: True mientras hay una sesión en curso
+        self.flush_interval = flush_interval
+        # Con este atraso se vuelca aunque haya una sesión en curso
+        self.flush_backlog_bytes = flush_backlog_bytes if flush_backlog_bytes is not None else max_bytes // 2
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        self.stats = {'flushed_sessions': 0, 'flushed_bytes': 0, 'flush_seconds': 0.0,
+                      'last_mb_s': 0.0, 'errors': 0}
+        self.staged_bytes = 0          # Ocupación del área local en la última comprobación
+        self.target_missing = False    # Hay sesiones por volcar y no hay pendrive
+        self.full = False              # No cabe otra sesión: la siguiente solo se imprime
+        self.last_warning = None
+        os.makedirs(root, exist_ok=True)
+
+    def session_dir(self, session, transient=False):
+        """Directorio local de una sesión (se crea si no existe).
+
+        Una sesión transitoria no se vuelca: se borra al terminar.
+        """
+        path = os.path.join(self.root, session)
+        os.makedirs(path, exist_ok=True)
+        if transient:
+            with open(os.path.join(path, TRANSIENT_MARKER), 'w'):
+                pass
+        return path
+
+    def has_room(self):
+        """Indica si cabe una sesión más sin pasar del máximo ni llenar el sistema de ficheros."""
+        total = self.evict()
+        self.check_size(total)
+        return not self.full
+
+    def room_for_session(self, total):
+        """Cabe una sesión más con el área ocupando total bytes."""
+        try:
+            free = shutil.disk_usage(self.root).free
+        except OSError:
+            free = 0
+        return total + self.session_bytes <= self.max_bytes and free - self.session_bytes >= MIN_FREE_BYTES
+
+    def mark_complete(self, session):
+        """Marca la sesión como terminada y despierta al hilo de volcado."""
+        path = os.path.join(self.root, session)
+        if not os.path.isdir(path):
+            return
+        if self.is_transient(session):
+            shutil.rmtree(path, ignore_errors=True)
+            print(f"Sesión {session} descartada del área local (no había sitio para conservarla)")
+            return
+        with open(os.path.join(path, COMPLETE_MARKER), 'w') as f:
+            os.fsync(f.fileno())
+        self.wakeup.set()
+
+    def reconcile(self, open_sessions):
+        """Al arrancar: da por terminadas las sesiones que el diario ya no tiene abiertas.
+
+        Cubre un corte de corriente después de cerrar la sesión en el diario
+        y antes de que el marcador llegara al disco.
+        """
+        for session in self.sessions():
+            if session not in open_sessions and not self.is_complete(session):
+                print(f"Sesión {session} del área local sin marcar como terminada. Marcándola...")
+                self.mark_complete(session)
+
+    def sessions(self):
+        """Sesiones en el área local, de la más antigua a la más reciente."""
+        try:
+            names = sorted(os.listdir(self.root))
+        except OSError:
+            return []
+        return [name for name in names if os.path.isdir(os.path.join(self.root, name))]
+
+    def is_flushed(self, session):
+        return os.path.exists(os.path.join(self.root, session, FLUSHED_MARKER))
+
+    def is_complete(self, session):
+        return os.path.exists(os.path.join(self.root, session, COMPLETE_MARKER))
+
+    def is_transient(self, session):
+        return os.path.exists(os.path.join(self.root, session, TRANSIENT_MARKER))
+
+    def backlog(self):
+        """(sesiones, bytes) terminadas que todavía no están en el pendrive."""
+        sessions, size = 0, 0
+        for session in self.sessions():
+            if self.is_complete(session) and not self.is_flushed(session):
+                sessions += 1
+                size += dir_size(os.path.join(self.root, session))
+        return sessions, size
+
+    def flush_session(self, session, target):
+        """Copia una sesión al pendrive y la verifica. Devuelve los bytes copiados."""
+        src_dir = os.path.join(self.root, session)
+        names = sorted(name for name in os.listdir(src_dir) if not name.startswith('.'))
+        copied = 0
+        digests = {}
+        for name in names:
+            src = os.path.join(src_dir, name)
+            dst = os.path.join(target, name)
+            digests[name] = copy_file_synced(src, dst)
+            copied += os.path.getsize(src)
+        fsync_dir(target)
+
+        # Verificar leyendo de nuevo desde el pendrive
+        for name, digest in digests.items():
+            if file_digest(os.path.join(target, name), drop_cache=True) != digest:
+                raise IOError(f"Verificación fallida para {name}")
+
+        with open(os.path.join(src_dir, FLUSHED_MARKER), 'w'):
+            pass
+        return copied
+
+    def flush(self):
+        """Vuelca al pendrive todas las sesiones terminadas pendientes.
+
+        El tamaño del área local se comprueba siempre, haya pendrive o no.
+        """
+        pending = [s for s in self.sessions() if self.is_complete(s) and not self.is_flushed(s)]
+        target = self.target_dir() if pending else None
+        self.target_missing = bool(pending) and target is None
+        flushed = self.flush_sessions(pending, target) if target is not None else 0
+        self.check_size(self.evict())
+        return flushed
+
+    def flush_sessions(self, pending, target):
+        """Copia las sesiones pendientes a target. Devuelve cuántas se han volcado."""
+        started = time.perf_counter()
+        flushed, copied = 0, 0
+        with self.lock:
+            for session in pending:
+                try:
+                    copied += self.flush_session(session, target)
+                    flushed += 1
+                except OSError as e:
+                    # Pendrive retirado o lleno: se reintenta en el siguiente ciclo
+                    print(f"Error al volcar la sesión {session} al pendrive: {e}")
+                    self.stats['errors'] += 1
+                    break
+        elapsed = time.perf_counter() - started
+
+        if flushed:
+            mb_s = copied / (1024 * 1024) / elapsed if elapsed else 0.0
+            self.stats['flushed_sessions'] += flushed
+            self.stats['flushed_bytes'] += copied
+            self.stats['flush_seconds'] += elapsed
+            self.stats['last_mb_s'] = round(mb_s, 2)
+            backlog_sessions, backlog_bytes = self.backlog()
+            print(f"Volcadas {flushed} sesiones al pendrive ({copied / (1024 * 1024):.1f} MB "
+                  f"en {elapsed:.1f} s, {mb_s:.1f} MB/s). Pendientes: {backlog_sessions} sesiones, "
+                  f"{backlog_bytes / (1024 * 1024):.1f} MB")
+        return flushed
+
+    def evict(self):
+        """Borra las sesiones más antiguas ya volcadas hasta que quepa una sesión más.
+
+        Devuelve lo que ocupa el área local después de borrar.
+        """
+        sessions = self.sessions()
+        total = sum(dir_size(os.path.join(self.root, s)) for s in sessions)
+        for session in sessions:
+            if total + self.session_bytes <= self.max_bytes:
+                break
+            if not self.is_flushed(session):
+                continue
+            path = os.path.join(self.root, session)
+            size = dir_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        return total
+
+    def check_size(self, total):
+        """Guarda la ocupación y avisa por consola si falta el pendrive o no cabe otra sesión."""
+        self.staged_bytes = total
+        self.full = not self.room_for_session(total)
+        message = self.status_message()
+        if message is None:
+            self.last_warning = None
+            return
+        now = time.monotonic()
+        if self.last_warning is None or now - self.last_warning >= WARN_INTERVAL:
+            self.last_warning = now
+            print(f"Aviso: {message}")
+
+    def status_message(self):
+        """Aviso para el encargado, o None si el volcado va bien."""
+        staged_mb = self.staged_bytes / (1024 * 1024)
+        if self.full:
+            return f"Área local llena ({staged_mb:.0f} MB): las fotos solo se imprimen"
+        if self.target_missing:
+            return f"Sin pendrive: {staged_mb:.0f} MB en local"
+        return None
+
+    def flush_loop(self):
+        """Bucle del hilo de volcado."""
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if not self.running:
+                break
+            try:
+                busy = self.is_busy() if self.is_busy else False
+                if busy and self.backlog()[1] < self.flush_backlog_bytes:
+                    continue
+                self.flush()
+            except Exception as e:
+                print(f"Error en el volcado al pendrive: {e}")
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.flush_loop)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def report(self):
+        """Estado del volcado: rendimiento y atraso."""
+        backlog_sessions, backlog_bytes = self.backlog()
+        stats = dict(self.stats)
+        stats['backlog_sessions'] = backlog_sessions
+        stats['backlog_bytes'] = backlog_bytes
+        stats['staged_bytes'] = self.staged_bytes
+        stats['target_missing'] = self.target_missing
+        stats['full'] = self.full
+        if stats['flush_seconds']:
+            stats['avg_mb_s'] = round(stats['flushed_bytes'] / (1024 * 1024) / stats['flush_seconds'], 2)
+        return stats